@@ -11,10 +11,7 @@ import numpy as np
 import pandas as pd
 import itertools
 
-from sklearn.svm import SVR
-from sklearn.neighbors import KNeighborsRegressor
 from sklearn.linear_model import BayesianRidge
-from sklearn.linear_model import ElasticNet
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import r2_score
 
@@ -56,9 +53,17 @@ bins = [30, 50, 65, 85]
 
 def implementMCCV(reg):
     '''Test the performance of a base regressor (reg) with REBAGG-RO resampling 
-    (m=100, s=600, cl=None, ch=72.2).'''
+    (m=100, s=600, cl=None, ch=72.2). If reg is a list of regressors, all are tested on
+    the same validation sets one after another, and a list of results is returned (so 
+    that Gram matrices cached by resreg.CachedKernelSVR are reused across C). A list of 
+    results is also returned for regressors with multiple columns of predictions, e.g.
+    one column for each alpha of resreg.ElasticNetPath or each k of 
+    resreg.KNeighborsPath.'''
     
-    r2_store, mcc_store, f1_store = [], [], []
+    regs = reg if isinstance(reg, list) else [reg]
+    r2_store = [[] for i in range(len(regs))]
+    mcc_store = [[] for i in range(len(regs))]
+    f1_store = [[] for i in range(len(regs))]
     for rrr in range(50):
         if rrr%10 == 0:
             print(rrr)
@@ -70,39 +75,47 @@ def implementMCCV(reg):
         X_test, y_test = X[test_indices,:], y[test_indices]
         
         
-        # Fit rebagg to training data   
-        relevance = resreg.sigmoid_relevance(y_train, cl=None, ch=72.2)
-        rebagg = resreg.Rebagg(m=100, s=600, base_reg=reg)
-        rebagg.fit(X_train, y_train, relevance, relevance_threshold=0.5, 
-                   sample_method='random_oversample', size_method='variation',
-                   random_state=rrr)
-        y_pred = rebagg.predict(X_test)
-    
-    
-        # Evaluate regressor performance on test set
-        r2 = r2_score(y_test, y_pred)
-        mcc = resreg.matthews_corrcoef(y_test, y_pred, bins)
-        relevance_true = resreg.sigmoid_relevance(y_test, cl=None, ch=65)
-        relevance_pred = resreg.sigmoid_relevance(y_pred, cl=None, ch=65)
-        f1 = resreg.f1_score(y_test, y_pred, error_threshold=5, 
-                         relevance_true=relevance_true, relevance_pred=relevance_pred,
-                         relevance_threshold=0.5, k=1e4)
+        for i, base_reg in enumerate(regs):
+            # Fit rebagg to training data   
+            relevance = resreg.sigmoid_relevance(y_train, cl=None, ch=72.2)
+            rebagg = resreg.Rebagg(m=100, s=600, base_reg=base_reg)
+            rebagg.fit(X_train, y_train, relevance, relevance_threshold=0.5, 
+                       sample_method='random_oversample', size_method='variation',
+                       random_state=rrr)
+            y_preds = rebagg.predict(X_test).reshape(len(y_test), -1).T
         
-        # Store performance results
-        r2_store.append(r2)
-        mcc_store.append(mcc)
-        f1_store.append(f1)
+            for y_pred in y_preds:
+                # Evaluate regressor performance on test set
+                r2 = r2_score(y_test, y_pred)
+                mcc = resreg.matthews_corrcoef(y_test, y_pred, bins)
+                relevance_true = resreg.sigmoid_relevance(y_test, cl=None, ch=65)
+                relevance_pred = resreg.sigmoid_relevance(y_pred, cl=None, ch=65)
+                f1 = resreg.f1_score(y_test, y_pred, error_threshold=5, 
+                                 relevance_true=relevance_true, 
+                                 relevance_pred=relevance_pred,
+                                 relevance_threshold=0.5, k=1e4)
+                
+                # Store performance results
+                r2_store[i].append(r2)
+                mcc_store[i].append(mcc)
+                f1_store[i].append(f1)
     
-    # Performance statistics
-    r2_mean, r2_std = np.mean(r2_store), np.std(r2_store)
-    f1_mean, f1_std = np.mean(f1_store), np.std(f1_store)
-    mcc_mean, mcc_std = np.mean(mcc_store), np.std(mcc_store)
-    
-    # Combine all performance data and write to excel spreadsheet
-    store = [r2_mean, f1_mean, mcc_mean, r2_std, f1_std, mcc_std]
+    stores = []
+    for i in range(len(regs)):
+        # Performance statistics of each column of predictions (over 50 folds)
+        r2_i = np.reshape(r2_store[i], (50, -1))
+        f1_i = np.reshape(f1_store[i], (50, -1))
+        mcc_i = np.reshape(mcc_store[i], (50, -1))
+        for j in range(r2_i.shape[1]):
+            r2_mean, r2_std = np.mean(r2_i[:,j]), np.std(r2_i[:,j])
+            f1_mean, f1_std = np.mean(f1_i[:,j]), np.std(f1_i[:,j])
+            mcc_mean, mcc_std = np.mean(mcc_i[:,j]), np.std(mcc_i[:,j])
+        
+            # Combine all performance data and write to excel spreadsheet
+            stores.append([r2_mean, f1_mean, mcc_mean, r2_std, f1_std, mcc_std])
     
     # Return result
-    return store
+    return stores if isinstance(reg, list) or len(stores) > 1 else stores[0]
 
 
 
@@ -111,12 +124,11 @@ def implementMCCV(reg):
 
 # Base regressors and hyperparameter range
 #=================================================#
-regressors = ['SVR', 'KNR', 'ENET', 'BAYR', 'MLPR']
+regressors = ['SVR', 'KNR', 'ENET', 'BAYR']
 ks = [3, 5, 7, 10, 15, 20, 30]
 cs_svr = 10.0 ** np.arange(-1,3)
 gamma_svr = 10.0 ** np.arange(-3,1)
 alphas = 10.0 ** np.arange(-3,3)
-alpha_mlpr = 10.0 ** np.arange(-5,1)
 
 
 
@@ -128,30 +140,23 @@ alpha_mlpr = 10.0 ** np.arange(-5,1)
 for regressor in regressors:
     print(regressor)
     if regressor == 'SVR':
+        # RBF Gram matrix of each training set computed once per gamma, and reused by
+        # all values of C (at most 1 GB of Gram matrices is kept)
         params = list(itertools.product(cs_svr, gamma_svr))
-        store_svr = []
-        for param in params:
-            print(param)
-            C, gamma = param
-            reg = SVR(kernel='rbf', C=C, gamma=gamma)
-            performance = implementMCCV(reg)
-            store_svr.append(performance)
+        kernel_cache = resreg.KernelCache(max_memory=1024)
+        regs = [resreg.CachedKernelSVR(C=C, gamma=gamma, kernel_cache=kernel_cache) \
+                for (C, gamma) in params]
+        store_svr = implementMCCV(regs)
         
     elif regressor == 'KNR':
-        store_knr = []
-        for k in ks:
-            print(k)
-            reg = KNeighborsRegressor(n_neighbors=k)
-            performance = implementMCCV(reg)
-            store_knr.append(performance)
+        # All values of k predicted from one search of the 30 nearest neighbors
+        reg = resreg.KNeighborsPath(n_neighbors=ks)
+        store_knr = implementMCCV(reg)
     
     elif regressor == 'ENET':
-        store_enet = []
-        for alpha in alphas:
-            print(alpha)
-            reg = ElasticNet(alpha=alpha)
-            performance = implementMCCV(reg)
-            store_enet.append(performance)
+        # All alphas fitted in one warm-started pass of coordinate descent
+        reg = resreg.ElasticNetPath(alphas=alphas)
+        store_enet = implementMCCV(reg)
     
     elif regressor == 'BAYR':
         reg = BayesianRidge()
@@ -166,6 +171,13 @@ for regressor in regressors:
 
 # Save results
 #====================#           
+# The SVR, KNR, and ENET results are not identical to those published in 
+# results/base_regressors, which were computed with sklearn's SVR, KNeighborsRegressor, 
+# and ElasticNet. CachedKernelSVR solves the same problem from a precomputed Gram 
+# matrix (differences within the solver tolerance), KNeighborsPath breaks ties between
+# equidistant neighbors differently, and ElasticNetPath warm-starts each alpha from the
+# previous one (coefficients differ by up to the coordinate descent tolerance). Running
+# this script overwrites the spreadsheets, so all four must be regenerated together.
 store_all = [store_svr, store_knr, store_enet, store_bayr]
 params_all = [itertools.product(cs_svr, gamma_svr),
               [3, 5, 7, 10, 15, 20, 30],
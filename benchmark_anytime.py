@@ -0,0 +1,101 @@
+"""
+Benchmark anytime prediction (Rebagg.predict_anytime) of a TOMER-style REBAGG ensemble
+with packed trees, stacked ridge regressors, and shared neighbor search against a loop
+over the regressors
+"""
+
+
+
+
+
+
+# Imports
+#============#
+
+import numpy as np
+import pandas as pd
+import time
+
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.linear_model import Ridge
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.preprocessing import StandardScaler
+
+import resreg
+
+
+
+
+
+
+# Get data and features
+#==============================#
+
+aalist = list('ACDEFGHIKLMNPQRSTVWY')
+def getAAC(seq):
+    aac = np.array([seq.count(x) for x in aalist])/len(seq)
+    return aac
+
+data = pd.read_excel('data/sequence_ogt_topt.xlsx', index_col=0)
+aac = np.array([getAAC(seq) for seq in data['sequence']])
+ogt = data['ogt'].values.reshape((data.shape[0],1))
+X = np.append(aac, ogt, axis=1)
+sc = StandardScaler()
+X = sc.fit_transform(X)
+y = data['topt'].values
+relevance = resreg.sigmoid_relevance(y, cl=None, ch=72.2)
+
+def best_time(func, repeats=5):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def loop_anytime(rebagg, X):
+    # Mean and standard deviation updated with one regressor at a time
+    for n, reg in enumerate(rebagg.fitted_regs, start=1):
+        y_reg = reg.predict(X)
+        if n == 1:
+            y_mean, m2 = y_reg, np.zeros(len(y_reg))
+        else:
+            delta = y_reg - y_mean
+            y_mean = y_mean + delta/n
+            m2 = m2 + delta * (y_reg - y_mean)
+    return y_mean, np.sqrt(m2/n)
+
+
+
+
+
+
+# Time taken to predict with return_std, and number of regressors within a budget
+#====================================================================================#
+base_regs = {'Packed trees': DecisionTreeRegressor(random_state=0),
+             'Ridge': Ridge(alpha=1.0),
+             'kNN': KNeighborsRegressor(n_neighbors=5)}
+store = []
+for name, base_reg in base_regs.items():
+    rebagg = resreg.Rebagg(m=100, s=600, base_reg=base_reg)
+    rebagg.fit(X, y, relevance, relevance_threshold=0.5,
+               sample_method='random_oversample', size_method='variation',
+               random_state=0)
+    if name == 'Packed trees':
+        rebagg.pack_trees()
+    for n_rows in [1, 350, X.shape[0]]:
+        X_batch = X[:n_rows]
+        # Same as predict_all (neighbors may differ from the loop for tied distances)
+        y_ensemble = rebagg.predict_all(X_batch)
+        y_pred, y_std = rebagg.predict(X_batch, return_std=True)
+        assert np.allclose(y_pred, y_ensemble.mean(axis=0))
+        assert np.allclose(y_std, y_ensemble.std(axis=0))
+        time_loop = best_time(lambda: loop_anytime(rebagg, X_batch))
+        time_batch = best_time(lambda: rebagg.predict(X_batch, return_std=True))
+        n_members = [rebagg.predict_anytime(X_batch, time_budget=0.005)[2] \
+                     for i in range(5)]
+        store.append([name, n_rows, time_loop, time_batch, int(np.median(n_members))])
+
+store = pd.DataFrame(store, columns=['regressors', 'rows', 'loop (s)', 'batch (s)',
+                                     'members in 5 ms'])
+print(store.to_string(index=False))
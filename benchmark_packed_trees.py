@@ -0,0 +1,86 @@
+"""
+Benchmark prediction with the packed decision trees of a TOMER-style REBAGG ensemble 
+(PackedTrees) against a loop over the trees
+"""
+
+
+
+
+
+
+# Imports
+#============#
+
+import numpy as np
+import pandas as pd
+import time
+
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.preprocessing import StandardScaler
+
+import resreg
+
+
+
+
+
+
+# Get data and features
+#==============================#
+
+aalist = list('ACDEFGHIKLMNPQRSTVWY')
+def getAAC(seq):
+    aac = np.array([seq.count(x) for x in aalist])/len(seq)
+    return aac
+
+data = pd.read_excel('data/sequence_ogt_topt.xlsx', index_col=0)
+aac = np.array([getAAC(seq) for seq in data['sequence']])
+ogt = data['ogt'].values.reshape((data.shape[0],1))
+X = np.append(aac, ogt, axis=1)
+sc = StandardScaler()
+X = sc.fit_transform(X)
+y = data['topt'].values
+
+
+
+
+
+
+# Fit TOMER-style ensemble (100 trees fitted to resampled data)
+#================================================================#
+relevance = resreg.sigmoid_relevance(y, cl=None, ch=72.2)
+rebagg = resreg.Rebagg(m=100, s=600, base_reg=DecisionTreeRegressor(random_state=0))
+rebagg.fit(X, y, relevance, relevance_threshold=0.5, sample_method='random_oversample',
+           size_method='variation', random_state=0)
+packed_trees = resreg.PackedTrees(rebagg.fitted_regs)
+
+def best_time(func, repeats=5):
+    times = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+
+
+
+
+# Time taken to predict batches of rows
+#=========================================#
+X_large = np.repeat(X, 10, axis=0) + \
+          np.random.RandomState(0).normal(scale=0.1, size=(10*X.shape[0], X.shape[1]))
+store = []
+for n_rows in [1, 10, 350, X.shape[0], X_large.shape[0]]:
+    X_batch = X_large[:n_rows] if n_rows > X.shape[0] else X[:n_rows]
+    y_loop = np.array([reg.predict(X_batch) for reg in rebagg.fitted_regs])
+    assert np.array_equal(packed_trees.predict_all(X_batch), y_loop)
+    time_loop = best_time(lambda: [reg.predict(X_batch) for reg in rebagg.fitted_regs])
+    time_packed = best_time(lambda: packed_trees.predict_all(X_batch))
+    time_threads = best_time(lambda: packed_trees.predict_all(X_batch, n_jobs=4))
+    store.append([n_rows, time_loop, time_packed, time_threads])
+
+store = pd.DataFrame(store, columns=['rows', 'loop (s)', 'packed (s)', 
+                                     'packed, 4 threads (s)'])
+print(store.to_string(index=False))
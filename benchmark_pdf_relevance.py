@@ -0,0 +1,91 @@
+"""
+Benchmark the exact and binned (FFT) kernel density modes of pdf_relevance, for the 
+target values of the Topt data and for larger synthetic target arrays
+"""
+
+
+
+
+
+
+# Imports
+#============#
+
+import numpy as np
+import pandas as pd
+import time
+
+from sklearn.neighbors import KernelDensity
+from sklearn.preprocessing import StandardScaler
+
+import resreg
+
+
+
+
+
+
+# Get data and features
+#==============================#
+
+aalist = list('ACDEFGHIKLMNPQRSTVWY')
+def getAAC(seq):
+    aac = np.array([seq.count(x) for x in aalist])/len(seq)
+    return aac
+
+data = pd.read_excel('data/sequence_ogt_topt.xlsx', index_col=0)
+aac = np.array([getAAC(seq) for seq in data['sequence']])
+ogt = data['ogt'].values.reshape((data.shape[0],1))
+X = np.append(aac, ogt, axis=1)
+sc = StandardScaler()
+X = sc.fit_transform(X)
+y = data['topt'].values
+
+
+
+
+
+
+# Error of binned relevance values (Topt data)
+#================================================#
+
+def error_bound(y, bandwidth, grid_size=2048):
+    '''Bound of the error of the binned relevance values (see pdf_relevance)'''
+    
+    spacing = (np.max(y) - np.min(y)) / (grid_size - 1)
+    e = spacing**2 / (4 * np.sqrt(2 * np.pi) * bandwidth**3)
+    pdf = np.exp(KernelDensity(bandwidth=bandwidth).fit(y[:,None]).score_samples(
+                                                                        y[:,None]))
+    return 4 * e / (pdf.max() - pdf.min() - 2 * e)
+
+for bandwidth in [1.0, 5.0]:
+    exact = resreg.pdf_relevance(y, bandwidth=bandwidth, method='exact')
+    binned = resreg.pdf_relevance(y, bandwidth=bandwidth, method='binned')
+    print(f'Bandwidth {bandwidth}: max error {np.max(np.abs(binned - exact)):.2e}, '
+          f'bound {error_bound(y, bandwidth):.2e}')
+
+
+
+
+
+
+# Time taken for synthetic target values (normal with exponential tail)
+#=========================================================================#
+rng = np.random.RandomState(0)
+store = []
+for n in [10**3, 10**4, 3*10**4, 10**5, 10**6]:
+    y_syn = np.append(rng.normal(50, 10, n - n//10), 70 + rng.exponential(10, n//10))
+    start = time.perf_counter()
+    binned = resreg.pdf_relevance(y_syn, bandwidth=1.0, method='binned')
+    time_binned = time.perf_counter() - start
+    if n <= 3*10**4:  # Exact density is too slow for larger arrays (395 s for 1e5)
+        start = time.perf_counter()
+        exact = resreg.pdf_relevance(y_syn, bandwidth=1.0, method='exact')
+        time_exact = time.perf_counter() - start
+        error = np.max(np.abs(binned - exact))
+    else:
+        time_exact, error = np.nan, np.nan
+    store.append([n, time_exact, time_binned, error])
+
+store = pd.DataFrame(store, columns=['n', 'exact (s)', 'binned (s)', 'max error'])
+print(store.to_string(index=False))
@@ -0,0 +1,85 @@
+"""
+Benchmark the loop and vectorized modes of SMOTER interpolation (smoter_interpolate) 
+on the rare domain of the Topt data
+"""
+
+
+
+
+
+
+# Imports
+#============#
+
+import numpy as np
+import pandas as pd
+import time
+
+from sklearn.preprocessing import StandardScaler
+
+import resreg
+
+
+
+
+
+
+# Get data and features
+#==============================#
+
+aalist = list('ACDEFGHIKLMNPQRSTVWY')
+def getAAC(seq):
+    aac = np.array([seq.count(x) for x in aalist])/len(seq)
+    return aac
+
+data = pd.read_excel('data/sequence_ogt_topt.xlsx', index_col=0)
+aac = np.array([getAAC(seq) for seq in data['sequence']])
+ogt = data['ogt'].values.reshape((data.shape[0],1))
+X = np.append(aac, ogt, axis=1)
+sc = StandardScaler()
+X = sc.fit_transform(X)
+y = data['topt'].values
+X_rare, y_rare = X[y > 70], y[y > 70]  # Rare domain
+
+
+
+
+
+
+# Distribution of synthetic samples (loop vs. vectorized)
+#==========================================================#
+size = 200000
+X_loop, y_loop = resreg.smoter_interpolate(X_rare, y_rare, k=5, size=size, 
+                                           random_state=0)
+X_vec, y_vec = resreg.smoter_interpolate(X_rare, y_rare, k=5, size=size, 
+                                         random_state=0, vectorize=True)
+print(f'Max difference of feature means: '
+      f'{np.max(np.abs(X_loop.mean(axis=0) - X_vec.mean(axis=0))):.4f}')
+print(f'Max difference of feature stds: '
+      f'{np.max(np.abs(X_loop.std(axis=0) - X_vec.std(axis=0))):.4f}')
+print(f'Target mean (loop, vectorized): {y_loop.mean():.3f}, {y_vec.mean():.3f}')
+print(f'Target std (loop, vectorized): {y_loop.std():.3f}, {y_vec.std():.3f}')
+
+
+
+
+
+
+# Time taken to generate synthetic samples
+#===============================================#
+store = []
+for size in [10**3, 10**4, 10**5, 10**6]:
+    start = time.perf_counter()
+    resreg.smoter_interpolate(X_rare, y_rare, k=5, size=size, random_state=0,
+                              vectorize=True)
+    time_vec = time.perf_counter() - start
+    if size <= 10**5:  # Loop is too slow for larger sizes
+        start = time.perf_counter()
+        resreg.smoter_interpolate(X_rare, y_rare, k=5, size=size, random_state=0)
+        time_loop = time.perf_counter() - start
+    else:
+        time_loop = np.nan
+    store.append([size, time_loop, time_vec])
+    
+store = pd.DataFrame(store, columns=['size', 'loop (s)', 'vectorized (s)'])
+print(store.to_string(index=False))
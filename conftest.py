@@ -0,0 +1 @@
+# Makes resreg importable when the tests are run with pytest from the repository root
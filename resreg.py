@@ -11,12 +11,145 @@ resreg: Resampling strategies for regression
 
 import numpy as np
 import pandas as pd
-from scipy.spatial.distance import pdist
-from scipy.spatial.distance import squareform
+from scipy.spatial.distance import cdist
+from scipy.signal import fftconvolve
 from sklearn.neighbors import KernelDensity
+from sklearn.neighbors import KDTree
+from sklearn.neighbors import BallTree
+from sklearn.neighbors import KNeighborsRegressor
 from sklearn import metrics
 from sklearn.tree import DecisionTreeRegressor
+from sklearn.tree import BaseDecisionTree
+from sklearn.linear_model import LinearRegression
+from sklearn.linear_model import Ridge
+from sklearn.linear_model import enet_path
+from sklearn.svm import SVR
+from sklearn.metrics.pairwise import rbf_kernel
+from sklearn.base import BaseEstimator, RegressorMixin
+from sklearn.utils.validation import has_fit_parameter
+from joblib import Parallel, delayed
 import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+import warnings
+
+
+
+
+
+
+#=======================================#
+# Random number generation
+#=======================================#
+
+class _SeededRandomState(np.random.RandomState):
+    """
+    RandomState created by check_random_state for an int or None seed (legacy_seed). 
+    When passed to a nested call, it is reseeded with legacy_seed by check_random_state
+    and shared with the caller, as the global RandomState of np.random was reseeded by
+    every call of earlier versions, so that the same random numbers are drawn without 
+    global state.
+    """
+    
+    def __init__(self, legacy_seed):
+        super().__init__(legacy_seed)
+        self.legacy_seed = legacy_seed
+
+
+
+
+def check_random_state(random_state):
+    """
+    Return a random number generator for random_state. 
+    
+    If random_state is an int or None, a new RandomState instance seeded with 
+    random_state is returned (see _SeededRandomState). It draws the same numbers as 
+    the global RandomState of np.random, which was seeded with random_state by earlier
+    versions, so that results are reproduced exactly for integer seeds, but the global
+    state of np.random is not modified. If random_state is a np.random.Generator or 
+    np.random.RandomState instance, it is returned unchanged and random numbers are 
+    drawn from it. If random_state is a np.random.SeedSequence, a new 
+    np.random.Generator is created from it. Random number generators that are not 
+    shared may be used safely in separate threads.
+    """
+    
+    if random_state is None or isinstance(random_state, (int, np.integer)):
+        return _SeededRandomState(random_state)
+    elif isinstance(random_state, _SeededRandomState):
+        random_state.seed(random_state.legacy_seed)
+        return random_state
+    elif isinstance(random_state, (np.random.Generator, np.random.RandomState)):
+        return random_state
+    elif isinstance(random_state, np.random.SeedSequence):
+        return np.random.default_rng(random_state)
+    else:
+        raise ValueError(f"{random_state} cannot be used as a random_state")
+
+
+
+
+def seed_sequence(random_state):
+    """
+    Return a np.random.SeedSequence for random_state (int, None, np.random.Generator, or
+    np.random.SeedSequence). Independent streams can be derived from the SeedSequence 
+    with spawn, or with child_seed_sequence.
+    """
+    
+    if isinstance(random_state, np.random.SeedSequence):
+        return random_state
+    elif isinstance(random_state, np.random.Generator):
+        return np.random.SeedSequence(random_state.integers(2**32, size=4))
+    elif isinstance(random_state, np.random.RandomState):
+        return np.random.SeedSequence(random_state.randint(2**32, size=4, dtype=np.uint64))
+    elif random_state is None or isinstance(random_state, (int, np.integer)):
+        return np.random.SeedSequence(random_state)
+    else:
+        raise ValueError(f"{random_state} cannot be used as a random_state")
+
+
+
+
+def child_seed_sequence(seed_seq, i):
+    """
+    Return the i-th child of a np.random.SeedSequence (seed_seq), which is the same as
+    seed_seq.spawn(i+1)[i] for a SeedSequence that has not been spawned yet, but does
+    not depend on previous calls to spawn.
+    """
+    
+    return np.random.SeedSequence(seed_seq.entropy, spawn_key=seed_seq.spawn_key + (i,),
+                                  pool_size=seed_seq.pool_size)
+
+
+
+
+def _nested_random_state(random_state, rng, i):
+    """
+    Return the random_state passed to the i-th nested call of a function that draws 
+    random numbers from rng = check_random_state(random_state). A SeedSequence gives 
+    its i-th child, so that nested calls draw independent streams. Otherwise, rng is 
+    returned and shared with the nested call, which continues its stream (or reseeds 
+    it, for an int or None seed, see _SeededRandomState).
+    """
+    
+    if isinstance(random_state, np.random.SeedSequence):
+        return child_seed_sequence(random_state, i)
+    return rng
+
+
+
+
+def set_random_state(estimator, seed_seq):
+    """
+    Set the random_state parameter of a scikit-learn estimator to a seed derived from a 
+    np.random.SeedSequence (seed_seq), if the estimator has a random_state parameter that
+    is None. Otherwise, the estimator is left unchanged.
+    """
+    
+    if hasattr(estimator, 'get_params') and \
+                estimator.get_params().get('random_state', 0) is None:
+        estimator.set_params(random_state=int(seed_seq.generate_state(1)[0]))
 
 
 
@@ -80,7 +213,7 @@ def sigmoid_relevance(y, cl, ch):
 
 
 
-def pdf_relevance(y, bandwidth=1.0):
+def pdf_relevance(y, bandwidth=1.0, method='exact', grid_size=2048):
     """
     Map an array (y) to relevance values (0 to 1) by taking the inverse of the
     probability density function (PDF). A kernel PDF is fitted to the target values using 
@@ -93,6 +226,21 @@ def pdf_relevance(y, bandwidth=1.0):
     bandwidth : float
         The bandwith of the kernel. Default is 1.0. Higher values indicate a smoother 
         curve.
+    method : str, {'exact' | 'binned'} (default='exact')
+        If 'exact', the Gaussian kernel density is evaluated at each value of y with 
+        sklearn.neighbors.KernelDensity, which takes O(n^2) time in the worst case.
+        
+        If 'binned', the values of y are linearly binned onto a grid of grid_size 
+        points spanning the range of y, the density at the grid points is computed by
+        FFT convolution with the kernel, and the density at each value of y is linearly
+        interpolated from the grid, in O(n + grid_size log(grid_size)) time. With grid 
+        spacing d = (max(y) - min(y)) / (grid_size - 1), binning and interpolation each 
+        change the density by at most d^2 / (8 sqrt(2 pi) bandwidth^3), so that the 
+        absolute error of the density is at most e = d^2 / (4 sqrt(2 pi) bandwidth^3), 
+        and the error of the relevance values at most 4e / (range of the exact 
+        density - 2e). Use a larger grid_size if d is not small relative to bandwidth.
+    grid_size : int (default=2048)
+        Number of grid points if method is 'binned'.
     
     Returns
     ----------
@@ -101,10 +249,32 @@ def pdf_relevance(y, bandwidth=1.0):
     """
     
     y = np.squeeze(np.asarray(y))
-    y = y.reshape(len(y),1)
-    pdf = KernelDensity(bandwidth=bandwidth, kernel='gaussian')
-    pdf.fit(y)
-    pdf_vals = np.exp(pdf.score_samples(y))
+    if method=='exact':
+        y = y.reshape(len(y),1)
+        pdf = KernelDensity(bandwidth=bandwidth, kernel='gaussian')
+        pdf.fit(y)
+        pdf_vals = np.exp(pdf.score_samples(y))
+    elif method=='binned':
+        if grid_size < 2:
+            raise ValueError('grid_size must be at least 2')
+        y = y.astype(np.float64).ravel()
+        grid = np.linspace(y.min(), y.max(), grid_size)
+        spacing = grid[1] - grid[0] if grid[-1] > grid[0] else 1.0
+        
+        # Linear binning: each value is split between its two neighboring grid points
+        pos = (y - grid[0]) / spacing
+        index = np.minimum(np.floor(pos).astype(np.intp), grid_size - 2)
+        frac = pos - index
+        counts = np.bincount(index, 1 - frac, minlength=grid_size) + \
+                 np.bincount(index + 1, frac, minlength=grid_size)
+        
+        # Density at the grid points, interpolated at y
+        offsets = np.arange(-(grid_size - 1), grid_size) * spacing / bandwidth
+        kernel = np.exp(-0.5 * offsets**2) / (np.sqrt(2 * np.pi) * bandwidth * len(y))
+        grid_pdf = fftconvolve(counts, kernel)[grid_size-1:2*grid_size-1]
+        pdf_vals = np.interp(y, grid, np.maximum(grid_pdf, 0))
+    else:
+        raise ValueError("method must be 'exact' or 'binned'")
     y_relevance = 1 - (pdf_vals - pdf_vals.min())/(pdf_vals.max() - pdf_vals.min())
     
     return y_relevance
@@ -112,6 +282,162 @@ def pdf_relevance(y, bandwidth=1.0):
 
 
 
+def _sigmoid_into(y, s, c, out):
+    """Compute sigmoid(y, s, c) into the array out, and return out"""
+    
+    np.subtract(y, c, out=out)
+    np.multiply(-s, out, out=out)
+    np.exp(out, out=out)
+    np.add(1, out, out=out)
+    return np.divide(1, out, out=out)
+
+
+
+
+class RelevanceFunction():
+    """
+    Sigmoid relevance (see sigmoid_relevance) of many pairs of centers (cl, ch) at once,
+    with memoized results. The relevance of all pairs for a target array is computed 
+    in a single broadcast operation, and stored with the fingerprint of the array, so 
+    that relevance values of the same targets and centers (e.g. of each training fold 
+    in a grid search) are computed only once. Values are identical to those of 
+    sigmoid_relevance. The cache stores a copy of each row, so that max_entries bounds 
+    its memory, and returns new (writable) arrays, as sigmoid_relevance does.
+    
+    Parameters
+    ------------
+    params : list of tuples or None (default=None)
+        Pairs of centers (cl, ch) evaluated by default by evaluate. Either center may be
+        None (see sigmoid_relevance), but not both.
+    max_entries : int (default=1024)
+        Maximum number of relevance arrays (of a target array and a pair of centers) 
+        stored. The least recently used array is evicted when the cache is full.
+    
+    Attributes
+    ------------
+    hits : int
+        Number of relevance arrays served from the cache.
+    misses : int
+        Number of relevance arrays computed.
+    
+    Examples
+    ----------
+    >>> relevance_func = RelevanceFunction(params=[(25.0, 72.2), (None, 60.0)])
+    >>> relevance = relevance_func.evaluate(y_train)  # Shape (2, len(y_train))
+    >>> relevance = relevance_func(y_train, cl=None, ch=60.0)  # From the cache
+    """
+    
+    
+    
+    
+    def __init__(self, params=None, max_entries=1024):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.params = params
+        self.max_entries = max_entries
+        self.hits, self.misses = 0, 0
+        self._relevance = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    
+    
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    
+    
+    
+    def __call__(self, y, cl, ch):
+        """Return the relevance of y with centers cl and ch (as sigmoid_relevance)"""
+        
+        param = (None if cl is None else float(cl), None if ch is None else float(ch))
+        key = (array_fingerprint(np.squeeze(np.asarray(y))), param)
+        with self._lock:
+            stored = self._relevance.get(key)
+            if stored is not None:
+                self._relevance.move_to_end(key)
+                self.hits += 1
+                return stored.copy()
+        return self.evaluate(y, params=[param])[0]
+    
+    
+    
+    
+    def evaluate(self, y, params=None):
+        """
+        Return the relevance of y for each pair of centers (cl, ch) in params (or in the
+        params of the instance if None), as an array with shape (len(params), len(y)).
+        """
+        
+        params = [(None if cl is None else float(cl), None if ch is None else float(ch))\
+                  for (cl, ch) in (self.params if params is None else params)]
+        if any(cl is None and ch is None for (cl, ch) in params):
+            raise ValueError('cl and ch must not both be None')
+        y = np.squeeze(np.asarray(y))
+        fingerprint = array_fingerprint(y)
+        relevance = np.empty((len(params), y.size))
+        with self._lock:
+            missing = []
+            for i, param in enumerate(params):
+                stored = self._relevance.get((fingerprint, param))
+                if stored is None:
+                    missing.append(i)
+                else:
+                    self._relevance.move_to_end((fingerprint, param))
+                    relevance[i] = stored
+            self.hits += len(params) - len(missing)
+            self.misses += len(missing)
+        
+        if missing:
+            # Centers and shapes of the sigmoids of all missing pairs (NaN if None)
+            offset = 0.001 * np.std(y)
+            cl = np.array([params[i][0] for i in missing], dtype=float) - offset
+            ch = np.array([params[i][1] for i in missing], dtype=float) + offset
+            sl, sh = -np.abs(np.log(1e4 - 1)/cl), np.abs(np.log(1e4 - 1)/ch)
+            values = relevance[missing] if len(missing) < len(params) else relevance
+            high = np.empty(y.size)
+            for j in range(len(missing)):
+                # Sigmoids computed in place, with the operations of sigmoid
+                if not np.isnan(cl[j]):
+                    _sigmoid_into(y, sl[j], cl[j], values[j])
+                    if not np.isnan(ch[j]):
+                        values[j] += _sigmoid_into(y, sh[j], ch[j], high)
+                else:
+                    _sigmoid_into(y, sh[j], ch[j], values[j])
+            relevance[missing] = values
+            with self._lock:
+                for i in missing:
+                    row = relevance[i].copy()  # Not a view of relevance
+                    row.flags.writeable = False
+                    self._relevance[(fingerprint, params[i])] = row
+                    self._relevance.move_to_end((fingerprint, params[i]))
+                while len(self._relevance) > self.max_entries:
+                    self._relevance.popitem(last=False)  # Evict least recently used
+        
+        return relevance
+    
+    
+    
+    
+    def clear(self):
+        """Remove all relevance arrays from the cache"""
+        
+        with self._lock:
+            self._relevance.clear()
+
+
+
+
 
 
 #===========================================================#
@@ -200,9 +526,11 @@ def uniform_test_split(X, y, bins, bin_test_size=0.5, verbose=False, random_stat
     verbose : bool, optional (default=False)
         If True, print a dataframe showing the range and the frequency of each bin for
         the training and testing set
-    random_state : int or None, optional (default=None)
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ----------
@@ -234,7 +562,7 @@ def uniform_test_split(X, y, bins, bin_test_size=0.5, verbose=False, random_stat
         raise ValueError("bin_test_size (float) must be between 0 and 1")
     
     # Sample training and testing set
-    np.random.seed(random_state)
+    rng = check_random_state(random_state)
     train_indices, test_indices = [], []
     train_freqs, test_freqs = [], []
     
@@ -246,7 +574,7 @@ def uniform_test_split(X, y, bins, bin_test_size=0.5, verbose=False, random_stat
                              'which has {1} samples.'.format(bin_test_size, 
                                                     min(bin_sizes)))
             
-        test_index = np.random.choice(bin_index, int(bin_test_size), replace=False)
+        test_index = rng.choice(bin_index, int(bin_test_size), replace=False)
         test_indices.extend(test_index)
         test_freqs.append(len(test_index))
         train_index = set(bin_index) - set(test_index)
@@ -621,20 +949,191 @@ def bin_performance(y_true, y_pred, bins, metric='MSE', error_threshold=None):
 # Functions for resampling datasets
 #======================================#
 
-def get_neighbors(X, k):
-    """Return indices of k nearest neighbors for each case in X"""
+def array_fingerprint(X):
+    """Return a hash string identifying the shape, type, and values of an array (X)"""
     
-    X = np.asarray(X)
-    dist = pdist(X)
-    dist_mat = squareform(dist)
-    order = [np.argsort(row) for row in dist_mat]
-    neighbor_indices = np.array([row[1:k+1] for row in order])
+    X = np.ascontiguousarray(X)
+    fingerprint = hashlib.sha1(str((X.shape, X.dtype.str)).encode())
+    fingerprint.update(X.view(np.uint8).ravel() if X.size else b'')
+    return fingerprint.hexdigest()
+
+
+
+
+class NeighborCache():
+    """
+    Cache of nearest-neighbor graphs, keyed by the fingerprint of the data matrix. A 
+    graph is computed once with the largest number of neighbors requested, and requests
+    for fewer neighbors are served as slices of the stored graph. Graphs are stored as
+    int32 arrays and the least recently used graph is evicted when the cache is full.
+    
+    Parameters
+    ------------
+    max_entries : int (default=32)
+        Maximum number of neighbor graphs stored.
+    k : int or None (default=None)
+        Minimum number of neighbors computed for each new graph. Set k to the largest 
+        number of neighbors that will be requested (e.g. max(ks) in a grid search) so 
+        that the graph of each dataset is computed only once.
+    
+    Attributes
+    ------------
+    hits : int
+        Number of requests served from the cache.
+    misses : int
+        Number of requests that required a neighbor search.
+    
+    Examples
+    ----------
+    >>> cache = NeighborCache(k=15)
+    >>> for k in [5, 10, 15]:
+    ...     X_new, y_new = smoter(X, y, relevance, k=k, neighbor_cache=cache)
+    """
+    
+    
+    
+    
+    def __init__(self, max_entries=32, k=None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.k = k
+        self.hits, self.misses = 0, 0
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+    
+    
+    
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    
+    
+    
+    def get(self, X, k, algorithm='brute', max_memory=256):
+        """
+        Return indices of k nearest neighbors for each case in X, computing and storing
+        the neighbor graph if it is not in the cache (see get_neighbors for parameters).
+        """
+        
+        X = np.asarray(X, dtype=float)
+        k = min(k, len(X) - 1)
+        key = array_fingerprint(X)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None and graph.shape[1] >= k:
+                self._graphs.move_to_end(key)
+                self.hits += 1
+                return graph[:, :k]
+            self.misses += 1
+        
+        k_graph = max(k, self.k or 0)
+        graph = get_neighbors(X, k_graph, algorithm=algorithm, 
+                              max_memory=max_memory).astype(np.int32)
+        graph.flags.writeable = False
+        with self._lock:
+            self._graphs[key] = graph
+            self._graphs.move_to_end(key)
+            while len(self._graphs) > self.max_entries:
+                self._graphs.popitem(last=False)  # Evict least recently used
+        return graph[:, :k]
+    
+    
+    
+    
+    def clear(self):
+        """Remove all neighbor graphs from the cache"""
+        
+        with self._lock:
+            self._graphs.clear()
+
+
+
+
+def get_neighbors(X, k, algorithm='brute', max_memory=256):
+    """
+    Return indices of k nearest neighbors (Euclidean distance) for each case in X. The
+    case itself is excluded from its neighbors.
+
+    Parameters
+    ------------
+    X : array-like or sparse matrix
+        Features of the data with shape (n_samples, n_features)
+    k : int
+        Number of nearest neighbors. If k is not less than n_samples, only n_samples - 1
+        neighbors are returned.
+    algorithm : str, {'brute' | 'kd_tree' | 'ball_tree'} (default='brute')
+        Algorithm used to search for nearest neighbors.
+
+        If 'brute', distances are computed exhaustively for blocks of rows, and the k
+        nearest neighbors in each block are selected with np.argpartition. Memory usage
+        is bounded by max_memory rather than the (n_samples, n_samples) distance matrix.
+
+        If 'kd_tree' or 'ball_tree', neighbors are searched with
+        sklearn.neighbors.KDTree or sklearn.neighbors.BallTree, respectively. Trees are
+        faster than 'brute' for large datasets with few features.
+
+        The algorithms return the same neighbors, except for ties: if several cases 
+        are at the same distance from a case (e.g. duplicate rows), their order, and 
+        which of them are returned at the k-th distance, may differ between algorithms.
+        A duplicate of a case may also be excluded in place of the case itself. The 
+        distances to the neighbors are the same for all algorithms.
+    max_memory : float (default=256)
+        Maximum size (in megabytes) of the block of distances computed at once if
+        algorithm is 'brute'.
+
+    Returns
+    --------
+    neighbor_indices : ndarray
+        Indices of the nearest neighbors of each case with shape (n_samples, k), sorted
+        by increasing distance.
+    """
+
+    X = np.asarray(X, dtype=float)
+    n = len(X)
+    k = min(k, n - 1)
+
+    if algorithm=='brute':
+        block_size = int(max_memory * 2**20 / (8 * 2 * n))  # distances and argpartition
+        block_size = min(max(block_size, 1), n)
+        neighbor_indices = np.empty((n, k), dtype=np.intp)
+        for start in range(0, n, block_size):
+            stop = min(start + block_size, n)
+            dist = cdist(X[start:stop], X)
+            if k + 1 < n:
+                nearest = np.argpartition(dist, k, axis=1)[:, :k+1]
+            else:
+                nearest = np.tile(np.arange(n), (stop - start, 1))
+            nearest_dist = np.take_along_axis(dist, nearest, axis=1)
+            order = np.argsort(nearest_dist, axis=1, kind='stable')
+            nearest = np.take_along_axis(nearest, order, axis=1)
+            neighbor_indices[start:stop] = nearest[:, 1:]
+
+    elif algorithm in ('kd_tree', 'ball_tree'):
+        tree = KDTree(X) if algorithm=='kd_tree' else BallTree(X)
+        nearest = tree.query(X, k=k+1, return_distance=False, sort_results=True)
+        neighbor_indices = nearest[:, 1:]
+
+    else:
+        raise ValueError("algorithm must be 'brute', 'kd_tree', or 'ball_tree'")
+
     return neighbor_indices
 
 
 
 
-def smoter_interpolate(X, y, k, size, nominal=None, random_state=None):
+def smoter_interpolate(X, y, k, size, nominal=None, neighbor_algorithm='brute', 
+                       neighbor_cache=None, vectorize=False, random_state=None):
     """
     Generate new cases by interpolating between cases in the data and a randomly
     selected nearest neighbor. For nominal features, random selection is carried out, 
@@ -652,9 +1151,20 @@ def smoter_interpolate(X, y, k, size, nominal=None, random_state=None):
         Number of new cases to generate
     nominal : ndarray (default=None)
         Column indices of nominal features. If None, then all features are continuous
-    random_state : int or None, optional (default=None)
+    neighbor_algorithm : str, {'brute' | 'kd_tree' | 'ball_tree'} (default='brute')
+        Algorithm used to search for nearest neighbors (see get_neighbors).
+    neighbor_cache : NeighborCache or None (default=None)
+        If not None, nearest neighbors are retrieved from (and stored in) the cache.
+    vectorize : bool (default=False)
+        If True, all new cases are generated at once with array operations, rather than
+        one at a time in a loop. Both modes draw new cases from the same distribution, 
+        but the random numbers are consumed in a different order, so the new cases 
+        differ for the same random_state.
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     --------
@@ -666,22 +1176,42 @@ def smoter_interpolate(X, y, k, size, nominal=None, random_state=None):
     
     X, y = np.asarray(X), np.squeeze(np.asarray(y))
     assert len(X)==len(y), 'X and y must be of the same length.'
-    neighbor_indices = get_neighbors(X, k)  # Get indices of k nearest neighbors
-    np.random.seed(seed=random_state)
-    sample_indices = np.random.choice(range(len(y)), size, replace=True) 
+    if neighbor_cache is not None:
+        neighbor_indices = neighbor_cache.get(X, k, algorithm=neighbor_algorithm)
+    else:
+        neighbor_indices = get_neighbors(X, k, algorithm=neighbor_algorithm)
+    rng = check_random_state(random_state)
+    sample_indices = rng.choice(range(len(y)), size, replace=True) 
+    
+    if vectorize:
+        # Draw a random neighbor and interpolation weight for all new cases at once
+        neighbor_cols = rng.choice(neighbor_indices.shape[1], size=size)
+        neighbors = neighbor_indices[sample_indices, neighbor_cols]
+        X_case, y_case = X[sample_indices,:], y[sample_indices]
+        X_neighbor, y_neighbor = X[neighbors,:], y[neighbors]
+        rand = np.repeat(rng.random((size, 1)), X.shape[1], axis=1)
+        if nominal is not None:
+            nominal_mask = np.zeros(X.shape[1], dtype=bool)
+            nominal_mask[nominal] = True
+            rand[:,nominal_mask] = rng.choice(2, size=(size, nominal_mask.sum()))
+        X_new = X_neighbor + (X_case - X_neighbor) * rand
+        d1 = np.linalg.norm(X_new - X_case, axis=1)
+        d2 = np.linalg.norm(X_new - X_neighbor, axis=1)
+        y_new = (d2 * y_case + d1 * y_neighbor) / (d2 + d1 + 1e-10)
+        return [X_new, y_new]
+    
     X_new, y_new = [], []
-        
     for i in sample_indices:
         # Get case and nearest neighbor
         X_case, y_case = X[i,:], y[i]
-        neighbor = np.random.choice(neighbor_indices[i,:])
+        neighbor = rng.choice(neighbor_indices[i,:])
         X_neighbor, y_neighbor = X[neighbor, :], y[neighbor]
         
         # Generate synthetic case by interpolation
-        rand = np.random.rand() * np.ones_like(X_case)
+        rand = rng.random() * np.ones_like(X_case)
         
         if nominal is not None:
-            rand = [np.random.choice([0,1]) if x in nominal else rand[x] \
+            rand = [rng.choice([0,1]) if x in nominal else rand[x] \
                     for x in range(len(rand))] # Random selection for nominal features, rather than interpolation
             rand = np.asarray(rand)
         diff = (X_case - X_neighbor) * rand
@@ -700,7 +1230,25 @@ def smoter_interpolate(X, y, k, size, nominal=None, random_state=None):
 
 
 
-def add_gaussian(X, y, delta, size, nominal=None, random_state=None):
+def nominal_frequencies(X, nominal):
+    """
+    Return the values and relative frequencies of nominal features in X, as a dictionary
+    mapping each column index in nominal to a tuple, (values, frequencies). The 
+    dictionary can be computed once for a dataset and passed to add_gaussian.
+    """
+    
+    X = np.asarray(X)
+    nominal_freqs = {}
+    for i in np.atleast_1d(nominal):
+        nom_vals, nom_freqs = np.unique(X[:, i], return_counts=True)
+        nominal_freqs[int(i)] = (nom_vals, nom_freqs/nom_freqs.sum())
+    return nominal_freqs
+
+
+
+
+def add_gaussian(X, y, delta, size, nominal=None, nominal_freqs=None, return_indices=False,
+                 random_state=None):
     """
     Generate new cases  by adding Gaussian noise to the dataset (X, y) . For nominal 
     features, selection is carried out with weights equal to the probability of the 
@@ -718,45 +1266,54 @@ def add_gaussian(X, y, delta, size, nominal=None, random_state=None):
         Number of new cases to generate
     nominal : ndarray (default=None)
         Column indices of nominal features. If None, then all features are continuous
-    random_state : int or None, optional (default=None)
+    nominal_freqs : dict or None (default=None)
+        Values and frequencies of nominal features in X, as returned by 
+        nominal_frequencies(X, nominal). If None, they are computed from X.
+    return_indices : bool (default=False)
+        If True, also return the indices of the cases in X to which noise is added.
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     --------
     [X_new, y_new] : list
         List contanining features (X_new) and target values (y_new) of new cases generated.
-        Dimensions of X_new and y_new are the same as X and y, respectively.
+        Dimensions of X_new and y_new are the same as X and y, respectively. If 
+        return_indices is True, [X_new, y_new, indices].
     """
     
     X, y = np.asarray(X), np.squeeze(np.asarray(y))
     assert len(X)==len(y), 'X and y must be of the same length.'
-    np.random.seed(seed=random_state)
-    sample_indices = np.random.choice(range(len(y)), size, replace=True)
+    rng = check_random_state(random_state)
+    sample_indices = rng.choice(range(len(y)), size, replace=True)
     stds_X, std_y = np.std(X, axis=0), np.std(y)
     X_sel, y_sel = X[sample_indices,:], y[sample_indices]
-    noise_X = np.array([[np.random.normal(loc=0.0, scale=std*delta) for std in stds_X] \
-                         for row in range(X_sel.shape[0])])
-    noise_y = np.random.normal(loc=0.0, scale=std_y*delta, size=y_sel.shape)
+    noise_X = rng.normal(loc=0.0, scale=stds_X*delta, size=X_sel.shape)
+    noise_y = rng.normal(loc=0.0, scale=std_y*delta, size=y_sel.shape)
     X_new = X_sel + noise_X
     y_new  = y_sel + noise_y
     
     # Deal with nominal features (selection with weights, not addition of noise)
     if nominal is not None:
-        for i in range(X_sel.shape[1]):
-            if i in nominal:
-                nom_vals, nom_freqs = np.unique(X[:, i], return_counts=True)
-                nom_freqs = nom_freqs/nom_freqs.sum()
-                nom_select = np.random.choice(nom_vals, size=X_sel.shape[0], p=nom_freqs,
-                                              replace=True)
-                X_new[:,i] = nom_select
-            
+        if nominal_freqs is None:
+            nominal_freqs = nominal_frequencies(X, nominal)
+        for i in sorted(set(np.atleast_1d(nominal))):
+            nom_vals, nom_freqs = nominal_freqs[i]
+            nom_select = rng.choice(nom_vals, size=X_sel.shape[0], p=nom_freqs,
+                                    replace=True)
+            X_new[:,i] = nom_select
+    
+    if return_indices:
+        return [X_new, y_new, sample_indices]
     return [X_new, y_new]
 
 
 
 
-def wercs_oversample(X, y, relevance, size, random_state=None):  
+def wercs_oversample(X, y, relevance, size, return_indices=False, random_state=None):
     """
     Generate new cases by selecting samples from the original dataset using the 
     relevance as weights. Samples with with high relevance are more likely to be selected
@@ -773,16 +1330,21 @@ def wercs_oversample(X, y, relevance, size, random_state=None):
         Values ranging from 0 to 1 that indicate the relevance of target values. 
     size : int
         Number of new cases to generate
-    random_state : int or None, optional (default=None)
+    return_indices : bool (default=False)
+        If True, also return the indices of the cases selected from X.
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     
    Returns
     --------
     [X_new, y_new] : list
         List contanining features (X_new) and target values (y_new) of new cases generated.
-        Dimensions of X_new and y_new are the same as X and y, respectively.
+        Dimensions of X_new and y_new are the same as X and y, respectively. If 
+        return_indices is True, [X_new, y_new, indices].
     """
     
     X, y,  = np.asarray(X), np.squeeze(np.asarray(y))
@@ -790,16 +1352,18 @@ def wercs_oversample(X, y, relevance, size, random_state=None):
     assert len(X)==len(y), 'X and y must be of the same length.'
     assert len(y)==len(relevance), 'y and relevance must be of the same length'
     prob = np.abs(relevance/np.sum(relevance))  # abs to remove very small negative values
-    np.random.seed(seed=random_state)
-    sample_indices = np.random.choice(range(len(X)), size=size, p=prob, replace=True)
+    rng = check_random_state(random_state)
+    sample_indices = rng.choice(range(len(X)), size=size, p=prob, replace=True)
     X_new, y_new = X[sample_indices,:], y[sample_indices]
     
+    if return_indices:
+        return X_new, y_new, sample_indices
     return X_new, y_new
 
 
 
 
-def wercs_undersample(X, y, relevance, size, random_state=None):
+def wercs_undersample(X, y, relevance, size, return_indices=False, random_state=None):
     """Undersample dataset by removing samples selected using the relevance as weights.
     Samples with low relevance are more likely to be removed in undersampling.
     
@@ -813,16 +1377,20 @@ def wercs_undersample(X, y, relevance, size, random_state=None):
         Values ranging from 0 to 1 that indicate the relevance of target values. 
     size : int
         Number of samples in new undersampled dataset (i.e. after removing samples)
-    random_state : int or None, optional (default=None)
+    return_indices : bool (default=False)
+        If True, also return the indices of the cases in X that are not removed.
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     --------
     [X_new, y_new] : list
         List contanining features (X_new) and target values (y_new) of cases after 
         removing samples. Dimensions of X_new and y_new are the same as X and y, 
-        respectively.
+        respectively. If return_indices is True, [X_new, y_new, indices].
     """
     
     X, y,  = np.asarray(X), np.squeeze(np.asarray(y))
@@ -833,11 +1401,13 @@ def wercs_undersample(X, y, relevance, size, random_state=None):
     prob = 1 - relevance
     prob = abs(prob/prob.sum())   # abs to remove very small negative numbers
     remove = len(y) - size
-    np.random.seed(seed=random_state)
-    sample_indices = np.random.choice(range(len(X)), size=remove, p=prob, replace=False)
+    rng = check_random_state(random_state)
+    sample_indices = rng.choice(range(len(X)), size=remove, p=prob, replace=False)
     sample_indices = list(set(range(len(X))) - set(sample_indices))
     X_new, y_new = X[sample_indices,:], y[sample_indices]
     
+    if return_indices:
+        return X_new, y_new, np.array(sample_indices, dtype=int)
     return X_new, y_new
     
 
@@ -855,9 +1425,11 @@ def undersample(X, y, size, random_state=None):
         The target values
     size : int
         Number of samples in new undersampled dataset.
-    random_state : int or None, optional (default=None)
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ----------
@@ -869,8 +1441,8 @@ def undersample(X, y, size, random_state=None):
     assert len(X)==len(y), 'X and y must be of the same length.'
     if size >= len(y):
         raise ValueError('size must be smaller than the length of y')
-    np.random.seed(random_state)
-    new_indices = np.random.choice(range(len(y)), size, replace=False)
+    rng = check_random_state(random_state)
+    new_indices = rng.choice(range(len(y)), size, replace=False)
     X_new, y_new = X[new_indices, :], y[new_indices]
     return [X_new, y_new]  
 
@@ -878,7 +1450,8 @@ def undersample(X, y, size, random_state=None):
 
         
 def oversample(X, y, size, method, k=None, delta=None, relevance=None, nominal=None,
-               random_state=None):
+               nominal_freqs=None, neighbor_algorithm='brute', neighbor_cache=None, 
+               vectorize=False, random_state=None):
     """
     Randomly oversample a dataset (X, y) and return a larger dataset (X_new, y_new)
     according to specified method.
@@ -917,9 +1490,24 @@ def oversample(X, y, size, method, k=None, delta=None, relevance=None, nominal=N
         specified if method is 'wercs' or 'wercs-gn'
     nominal : ndarray (default=None)
         Column indices of nominal features. If None, then all features are continuous.
-    random_state : int or None, optional (default=None)
+    nominal_freqs : dict or None (default=None)
+        Values and frequencies of nominal features in X, as returned by
+        nominal_frequencies, used if method is 'gaussian'. If None, they are computed 
+        from X.
+    neighbor_algorithm : str, {'brute' | 'kd_tree' | 'ball_tree'} (default='brute')
+        Algorithm used to search for nearest neighbors if method is 'smoter' (see 
+        get_neighbors).
+    neighbor_cache : NeighborCache or None (default=None)
+        If not None, nearest neighbors are retrieved from (and stored in) the cache if 
+        method is 'smoter'.
+    vectorize : bool (default=False)
+        If True and method is 'smoter', synthetic samples are generated at once with 
+        array operations (see smoter_interpolate).
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ----------
@@ -937,22 +1525,28 @@ def oversample(X, y, size, method, k=None, delta=None, relevance=None, nominal=N
     
     
     # Generate extra samples for oversampling
-    np.random.seed(seed=random_state)
+    rng = check_random_state(random_state)
     if method=='duplicate':
-        more_indices = np.random.choice(np.arange(len(y)), moresize, replace=True)
+        more_indices = rng.choice(np.arange(len(y)), moresize, replace=True)
         X_more, y_more = X[more_indices,:], y[more_indices]
         
     elif method=='smoter':
         if k is None:
             raise ValueError("Must specify k if method is 'smoter'")
+        nested_state = _nested_random_state(random_state, rng, 0)
         [X_more, y_more] = smoter_interpolate(X, y, k, size=moresize, nominal=nominal, 
-                                              random_state=random_state)
+                                              neighbor_algorithm=neighbor_algorithm,
+                                              neighbor_cache=neighbor_cache,
+                                              vectorize=vectorize,
+                                              random_state=nested_state)
     
     elif method=='gaussian':
         if delta is None:
             raise ValueError("Must specify delta if method is 'gaussian'")
+        nested_state = _nested_random_state(random_state, rng, 1)
         [X_more, y_more] = add_gaussian(X, y, delta, size=moresize, nominal=nominal,
-                                        random_state=random_state)
+                                        nominal_freqs=nominal_freqs,
+                                        random_state=nested_state)
     
     elif method=='wercs' or method=='wercs-gn':
         if relevance is None:
@@ -960,14 +1554,16 @@ def oversample(X, y, size, method, k=None, delta=None, relevance=None, nominal=N
         else:
             assert len(y)==len(relevance), 'y and relevance must be of the same length'
             
+        nested_state = _nested_random_state(random_state, rng, 2)
         [X_more, y_more] = wercs_oversample(X, y, relevance, size=moresize, 
-                                            random_state=random_state)
+                                            random_state=nested_state)
         if method=='wercs-gn':
             if delta is None:
                 raise ValueError("Must specify delta if method is 'wercs-gn'")
            
+            nested_state = _nested_random_state(random_state, rng, 3)
             [X_more, y_more] = add_gaussian(X_more, y_more, delta, size=moresize, 
-                                            nominal=nominal, random_state=random_state)
+                                            nominal=nominal, random_state=nested_state)
     else:
         raise ValueError('Wrong method specified.')
     
@@ -1064,9 +1660,11 @@ def random_undersample(X, y, relevance, relevance_threshold=0.5, under='balance'
         
         If 'average', the extent of undersampling is intermediate between 'balance' and 
         'extreme'.
-    random_state : int or None, optional (default=None)
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ---------
@@ -1140,9 +1738,11 @@ def random_oversample(X, y, relevance, relevance_threshold=0.5, over='balance',
         
         If 'medium', the extent of oversampling is intermediate between 'balance' and 
         'extreme'.
-    random_state : int or None, optional (default=None)
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ---------
@@ -1184,7 +1784,8 @@ def random_oversample(X, y, relevance, relevance_threshold=0.5, over='balance',
 
 
 def smoter(X, y, relevance, relevance_threshold=0.5, k=5, over='balance', under=None, 
-		   nominal=None, random_state=None):
+		   nominal=None, neighbor_algorithm='brute', neighbor_cache=None, 
+		   vectorize=False, random_state=None):
     """
     Resample imbalanced dataset with the SMOTER algorithm. The dataset is split into a 
     rare normal domain using relevance values. Target values with relevance below the 
@@ -1225,9 +1826,20 @@ def smoter(X, y, relevance, relevance_threshold=0.5, k=5, over='balance', under=
         over is float. One-third of normal samples are removed if under=0.33.
     nominal : ndarray (default=None)
         Column indices of nominal features. If None, then all features are continuous.
-    random_state : int or None, optional (default=None)
+    neighbor_algorithm : str, {'brute' | 'kd_tree' | 'ball_tree'} (default='brute')
+        Algorithm used to search for nearest neighbors (see get_neighbors).
+    neighbor_cache : NeighborCache or None (default=None)
+        If not None, nearest neighbors are retrieved from (and stored in) the cache. 
+        Sharing a cache across calls avoids repeating the neighbor search on the same
+        data for different values of k.
+    vectorize : bool (default=False)
+        If True, synthetic samples are generated at once with array operations (see
+        smoter_interpolate).
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ---------
@@ -1266,6 +1878,7 @@ def smoter(X, y, relevance, relevance_threshold=0.5, k=5, over='balance', under=
                          "'balance', 'extreme', or 'average'")
         
     # Oversample rare domain
+    rng = check_random_state(random_state)
     y_median = np.median(y)
     low_indices = np.where(y_rare < y_median)[0]
     high_indices = np.where(y_rare >= y_median)[0]
@@ -1273,16 +1886,22 @@ def smoter(X, y, relevance, relevance_threshold=0.5, k=5, over='balance', under=
     # First oversample low rare cases
     if len(low_indices) != 0:
         size = int(len(low_indices)/rare_size * new_rare_size)
+        nested_state = _nested_random_state(random_state, rng, 0)
         X_low_rare, y_low_rare = oversample(X_rare[low_indices,:], y_rare[low_indices], 
                                      size=size, method='smoter', k=k, relevance=relevance,
-                                     nominal=nominal, random_state=random_state)
+                                     nominal=nominal, neighbor_algorithm=neighbor_algorithm,
+                                     neighbor_cache=neighbor_cache, vectorize=vectorize,
+                                     random_state=nested_state)
         
     # Then do high rare cases
     if len(high_indices) != 0:
         size = int(len(high_indices)/rare_size * new_rare_size)
+        nested_state = _nested_random_state(random_state, rng, 1)
         X_high_rare, y_high_rare = oversample(X_rare[high_indices], y_rare[high_indices],
                                      size=size, method='smoter', k=k, relevance=relevance,
-                                     nominal=nominal, random_state=random_state)
+                                     nominal=nominal, neighbor_algorithm=neighbor_algorithm,
+                                     neighbor_cache=neighbor_cache, vectorize=vectorize,
+                                     random_state=nested_state)
     
     # Combine oversampled low and high rare cases
     if min(len(low_indices), len(high_indices)) != 0:
@@ -1296,8 +1915,9 @@ def smoter(X, y, relevance, relevance_threshold=0.5, k=5, over='balance', under=
         y_rare_new = y_low_rare
         
     # Undersample normal cases
+    nested_state = _nested_random_state(random_state, rng, 2)
     X_norm_new, y_norm_new = undersample(X_norm, y_norm, size=new_norm_size, 
-                                         random_state=random_state)
+                                         random_state=nested_state)
     
     # Combine resampled rare and normal cases
     X_new = np.append(X_rare_new, X_norm_new, axis=0)
@@ -1350,9 +1970,11 @@ def gaussian_noise(X, y, relevance, relevance_threshold=0.5, delta=0.1, over=Non
         over is float. One-third of normal samples are removed if under=0.33.
     nominal : ndarray (default=None)
         Column indices of nominal features. If None, then all features are continuous.
-    random_state : int or None, optional (default=None)
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ---------
@@ -1390,6 +2012,7 @@ def gaussian_noise(X, y, relevance, relevance_threshold=0.5, delta=0.1, over=Non
                          "'balance', 'extreme', or 'average'")
         
     # Oversample rare domain
+    rng = check_random_state(random_state)
     y_median = np.median(y)
     low_indices = np.where(y_rare < y_median)[0]
     high_indices = np.where(y_rare >= y_median)[0]
@@ -1397,18 +2020,20 @@ def gaussian_noise(X, y, relevance, relevance_threshold=0.5, delta=0.1, over=Non
     # First oversample low rare cases
     if len(low_indices) != 0:
         size = int(len(low_indices)/rare_size * new_rare_size)
+        nested_state = _nested_random_state(random_state, rng, 0)
         X_low_rare, y_low_rare = oversample(X_rare[low_indices,:], y_rare[low_indices], 
                                            size=size, method='gaussian', delta=delta, 
                                            relevance=relevance, nominal=nominal, 
-                                           random_state=random_state)
+                                           random_state=nested_state)
         
     # Then do high rare cases
     if len(high_indices) != 0:
         size = int(len(high_indices)/rare_size * new_rare_size)
+        nested_state = _nested_random_state(random_state, rng, 1)
         X_high_rare, y_high_rare = oversample(X_rare[high_indices], y_rare[high_indices],
                                      size=size, method='gaussian', delta=delta, 
                                      relevance=relevance, nominal=nominal, 
-                                     random_state=random_state)
+                                     random_state=nested_state)
     
     # Combine oversampled low and high rare cases
     if min(len(low_indices), len(high_indices)) != 0:
@@ -1422,8 +2047,9 @@ def gaussian_noise(X, y, relevance, relevance_threshold=0.5, delta=0.1, over=Non
         y_rare_new = y_low_rare
         
     # Undersample normal cases
+    nested_state = _nested_random_state(random_state, rng, 2)
     X_norm_new, y_norm_new = undersample(X_norm, y_norm, size=new_norm_size, 
-                                         random_state=random_state)
+                                         random_state=nested_state)
     
     # Combine resampled rare and normal cases
     X_new = np.append(X_rare_new, X_norm_new, axis=0)
@@ -1435,7 +2061,7 @@ def gaussian_noise(X, y, relevance, relevance_threshold=0.5, delta=0.1, over=Non
 
 
 def wercs(X, y, relevance, over=0.5, under=0.5, noise=False, delta=0.1, nominal=None,
-          random_state=None):
+          return_indices=False, random_state=None):
     """
     Resample imbalanced dataset with the WERCS algorithm. The relevance values are used
     as weights to select samples for oversampling and undersampling such that samples with
@@ -1460,15 +2086,21 @@ def wercs(X, y, relevance, over=0.5, under=0.5, noise=False, delta=0.1, nominal=
         Value that determines the magnitude of Gaussian noise added.
     nominal : ndarray (default=None)
         Column indices of nominal features. If None, then all features are continuous.
-    random_state : int or None, optional (default=None)
+    return_indices : bool (default=False)
+        If True, also return the index of the case in X from which each case in the 
+        resampled dataset is drawn (before adding noise if noise is True).
+    random_state : int, None, Generator or SeedSequence, optional (default=None)
         If int, random_state is the seed used by the random number generator. If None, 
-        the random number generator is the RandomState instance used by np.random.
+        the random number generator is seeded with fresh entropy. If np.random.Generator,
+        random numbers are drawn from it, and if np.random.SeedSequence, from a new 
+        Generator. The global state of np.random is not used (see check_random_state).
     
     Returns
     ---------
     [X_new, y_new] : list
         List contanining features (X_new) and target values (y_new) of resampled dataset
-        (both normal and rare samples).
+        (both normal and rare samples). If return_indices is True, 
+        [X_new, y_new, indices].
     
     References
     -----------
@@ -1480,16 +2112,28 @@ def wercs(X, y, relevance, over=0.5, under=0.5, noise=False, delta=0.1, nominal=
     relevance = np.squeeze(np.asarray(relevance))
     over_size = int(over * len(y))
     under_size = int((1 - under) * len(y))
-    X_over, y_over = wercs_oversample(X, y, relevance=relevance, size=over_size, 
-                                      random_state=random_state) # Oversample
-    X_under, y_under = wercs_undersample(X, y, relevance=relevance, size=under_size,
-                                         random_state=random_state)
+    rng = check_random_state(random_state)
+    nested_state = _nested_random_state(random_state, rng, 0)
+    X_over, y_over, over_indices = wercs_oversample(X, y, relevance=relevance, 
+                                                    size=over_size, return_indices=True,
+                                                    random_state=nested_state) # Oversample
+    nested_state = _nested_random_state(random_state, rng, 1)
+    X_under, y_under, under_indices = wercs_undersample(X, y, relevance=relevance, 
+                                                        size=under_size, 
+                                                        return_indices=True,
+                                                        random_state=nested_state)
     if noise:
-        X_under, y_under = add_gaussian(X_under, y_under, delta=delta, size=under_size,
-                                        nominal=nominal, random_state=random_state)
+        nested_state = _nested_random_state(random_state, rng, 2)
+        X_under, y_under, noise_indices = add_gaussian(X_under, y_under, delta=delta, 
+                                                       size=under_size, nominal=nominal,
+                                                       return_indices=True,
+                                                       random_state=nested_state)
+        under_indices = under_indices[noise_indices]
     X_new = np.append(X_over, X_under, axis=0)
     y_new = np.append(y_over, y_under, axis=0)
     
+    if return_indices:
+        return [X_new, y_new, np.append(over_indices, under_indices)]
     return [X_new, y_new]
     
 
@@ -1501,84 +2145,1129 @@ def wercs(X, y, relevance, over=0.5, under=0.5, noise=False, delta=0.1, nominal=
 # Combining ensemble learning (bagging) and resampling methods
 #================================================================#
 
-class Rebagg():
+class PackedTrees():
     """
-    Rebagg implements resampled bagging to deal with data imbalance in regression 
-    problems. Each regressor in the bagging ensemble is fitted to a resampled dataset. 
-    Resampling may be implemented by random oversampling, SMOTER, addition of Gaussian 
-    noise, or the WERCS algorithm.
+    Fitted decision trees packed into flat node arrays (feature, threshold, children, 
+    and value), so that all trees are traversed together with array operations rather 
+    than by calling the predict method of each tree. Predictions are identical to those
+    of the trees.
+    
+    Packing removes the overhead of validating and converting X for every tree, which 
+    dominates prediction time for small batches of samples. For large batches, the 
+    compiled traversal of scikit-learn is faster per sample, unless rows are traversed 
+    in several threads (n_jobs).
     
     Parameters
     ------------
-    m : int (default=100)
-        Number of models (regressors) in the ensemble
-    s : int or float (default=0.5)
-        Number of bootstrap samples drawn to fit the base regressors. If int, then *s* 
-        samples are drawn. If float, then *X.shape[0] * s* samples are drawn.
-    base_reg : scikit-learn regressor or None, optional (default=None)
-        The base regressor to fit random subsets of the dataset. If None, then *base_reg* 
-        is a decision tree with default settings.
-   
+    trees : list
+        Fitted scikit-learn decision tree regressors (single output).
+    feature_indices : list of arrays or None (default=None)
+        Indices of the features (columns of X) each tree was fitted to, if the trees 
+        were fitted to subsets of features. The split features of each tree are mapped
+        to columns of X, so that all trees are traversed with the same X.
+    n_features : int or None (default=None)
+        Number of features of X. Must be specified if feature_indices is not None.
+    
     Attributes
     ------------
-    fitted_regs : list
-        A list of base regressors which have been fitted to bootstrap samples of the 
-        dataset.
-    pred_std : ndarray
-        An array of the standard deviation of predicted values after calling the predict
-        method.
-        
-    References
-    -----------
-    ..  [1] Branco, P., Torgo, L., Ribeiro, R.P. (2018). Rebagg: Resampled bagging for 
-        imbalanced regression.
-    
-    Examples
-    ----------
-    >>> from sklearn.neighbors import KNeighborsRegressor
-    >>> knreg = KNeighborsRegressor(n_neighbors=10)
-    >>> #
-    >>> # Initialize an ensemble of 50 KNN regressors, with each base regressor fitted to
-    >>> # a resampled dataset of 200 samples
-    >>> #
-    >>> rebagg = Rebagg(m=50, s=200, base_reg=knreg) 
-    >>> rebagg.fit(X_train, y_train) # Resample dataset and fit base regressors
-    >>> y_pred = rebagg.predict(X_test)
-    >>> y_std = rebagg.pred_std  # Standard deviation of ensemble predictions
-    
+    roots : ndarray
+        Index of the root node of each tree in the node arrays.
+    n_features : int
+        Number of features of the data the trees were fitted to.
     """
     
     
     
     
-    def __init__(self, m=100, s=0.5, base_reg=None):
-        self.m = m
-        if type(s) not in [int, float]:
-            raise TypeError("s must be int or float")
-        self.s = s
-        if base_reg is not None:
-            self.base_reg = base_reg
+    def __init__(self, trees, feature_indices=None, n_features=None):
+        features, thresholds, children, is_leaf, values, roots = [], [], [], [], [], []
+        offset = 0
+        if feature_indices is None:
+            self.n_features = trees[0].n_features_in_
+        elif n_features is None:
+            raise ValueError('n_features must be specified with feature_indices')
         else:
-            self.base_reg = DecisionTreeRegressor()
-        self._isfitted = False
+            self.n_features = n_features
+        for i, tree in enumerate(trees):
+            tree = tree.tree_
+            if feature_indices is None:
+                features.append(tree.feature)
+            else:
+                # Map split features to columns of X (leaves keep negative values)
+                features.append(np.where(tree.feature >= 0, 
+                                         np.asarray(feature_indices[i])[tree.feature], 
+                                         tree.feature))
+            thresholds.append(tree.threshold)
+            children.append(np.stack([tree.children_left, tree.children_right], axis=1) +
+                            offset)
+            is_leaf.append(tree.children_left == -1)
+            values.append(tree.value[:,0,0])
+            roots.append(offset)
+            offset += tree.node_count
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.children = np.concatenate(children).ravel().astype(np.intp)  # left, right
+        self.is_leaf = np.concatenate(is_leaf)
+        self.value = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+    
+    
+    
+    
+    def leaves(self, X, trees=None):
+        """Return the index of the leaf reached by each case in X for each tree (or the 
+        trees selected by trees, a slice or array of indices), as an array with shape 
+        (n_trees, n_samples)"""
+        
+        X = np.ascontiguousarray(X, dtype=np.float32)  # Same precision as scikit-learn
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X must have {self.n_features} features")
+        roots = self.roots if trees is None else self.roots[trees]
+        n_trees, (n, d) = len(roots), X.shape
+        X_flat = X.ravel()
         
+        # Traverse all (tree, sample) pairs at once, dropping pairs that reach a leaf
+        nodes = np.repeat(roots, n)
+        offsets = np.tile(np.arange(n) * d, n_trees)
+        pairs = np.arange(n_trees * n)
+        leaves = np.empty(n_trees * n, dtype=np.intp)
+        is_leaf = self.is_leaf[nodes]
+        while True:
+            if is_leaf.any():
+                leaves[pairs[is_leaf]] = nodes[is_leaf]
+                active = ~is_leaf
+                nodes, offsets, pairs = nodes[active], offsets[active], pairs[active]
+            if len(nodes) == 0:
+                break
+            go_right = X_flat[offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = self.children[2 * nodes + go_right]
+            is_leaf = self.is_leaf[nodes]
+        return leaves.reshape(n_trees, n)
+    
+    
+    
+    
+    def predict_all(self, X, n_jobs=None, chunk_size=1024, trees=None):
+        """
+        Return the predictions of all trees (or the trees selected by trees, a slice or
+        array of indices) for X, as an array with shape (n_trees, n_samples). Rows are 
+        traversed in blocks of chunk_size rows, in parallel threads if n_jobs is not 
+        None.
+        """
         
+        X = np.asarray(X, dtype=np.float32)
+        chunks = range(0, len(X), chunk_size)
+        if n_jobs is None or len(chunks) <= 1:
+            leaves = [self.leaves(X[i:i+chunk_size], trees) for i in chunks]
+        else:
+            leaves = Parallel(n_jobs=n_jobs, prefer='threads')(
+                        delayed(self.leaves)(X[i:i+chunk_size], trees) for i in chunks)
+        return self.value[np.concatenate(leaves, axis=1)]
+
+
+
 
+
+
+def quantize_features(X, max_bins=256):
+    """
+    Quantize each feature of X into at most max_bins bins (uint8), as in histogram-based
+    gradient boosting. If a feature has at most max_bins distinct values, each value has
+    its own bin. Otherwise, bin thresholds are quantiles of the feature. Values are 
+    compared in single precision, as in the decision trees of scikit-learn.
     
-    def sample(self, X, y, relevance, relevance_threshold, 
-               sample_method='random_oversample', size_method='balance', k=5, delta=0.1, 
-               over=0.5, under=0.5, nominal=None, random_state=None):
-        """ 
-        Resample dataset and return a smaller balanced dataset for fitting a single 
-        regressor in the ensemble.
-        
-        Parameters
-        ------------
-        X : array-like or sparse matrix 
-            Features of the data.
-        y : array-like
-            The target values.
-        relevance : 1d array-like
+    Parameters
+    ------------
+    X : array-like
+        Features of the data with shape (n_samples, n_features).
+    max_bins : int (default=256)
+        Maximum number of bins of each feature (at most 256).
+    
+    Returns
+    ---------
+    (X_binned, bin_thresholds) : tuple
+        Bin of each value of X (X_binned, ndarray of uint8), and list of the thresholds 
+        of the bins of each feature (bin_thresholds), such that a value x is in bin b if
+        bin_thresholds[j][b-1] < x <= bin_thresholds[j][b].
+    """
+    
+    if not 2 <= max_bins <= 256:
+        raise ValueError('max_bins must be between 2 and 256')
+    X = np.asarray(X, dtype=np.float32)
+    assert np.all(np.isfinite(X)), 'X must not contain NaN or infinite values'
+    X_binned = np.empty(X.shape, dtype=np.uint8)
+    bin_thresholds = []
+    for j in range(X.shape[1]):
+        distinct = np.unique(X[:,j]).astype(np.float64)
+        if len(distinct) <= max_bins:
+            thresholds = (distinct[:-1] + distinct[1:]) / 2  # Midpoints
+        else:
+            quantiles = np.linspace(0, 100, max_bins + 1)[1:-1]
+            thresholds = np.unique(np.percentile(X[:,j], quantiles, method='midpoint'))
+        X_binned[:,j] = np.searchsorted(thresholds, X[:,j], side='left')
+        bin_thresholds.append(thresholds)
+    
+    return X_binned, bin_thresholds
+
+
+
+
+def _unbin_tree(tree, bin_thresholds):
+    """Replace the thresholds of a decision tree fitted to quantized features (see 
+    quantize_features) with the thresholds of the bins, so that the tree predicts from 
+    the features. bin_thresholds are the thresholds of the columns the tree was fitted 
+    to. A threshold t between bins sends the bins b <= floor(t) to the left child, i.e.
+    the values x <= bin_thresholds[j][floor(t)]."""
+    
+    split = tree.tree_.feature >= 0
+    features = tree.tree_.feature[split]
+    bins = np.floor(tree.tree_.threshold[split]).astype(np.intp)
+    tree.tree_.threshold[split] = [bin_thresholds[j][b] for (j, b) in zip(features, bins)]
+    return tree
+
+
+
+
+
+
+def _linear_alpha(reg):
+    """Return the regularization strength of reg if it is a Ridge or LinearRegression 
+    regressor that can be fitted with fit_linear_members, and None otherwise"""
+    
+    if type(reg) is LinearRegression and not reg.positive:
+        return 0.0
+    if type(reg) is Ridge and not reg.positive and np.ndim(reg.alpha)==0:
+        return float(reg.alpha)
+    return None
+
+
+
+
+def fit_linear_members(X, y, counts, alpha=0.0, fit_intercept=True, 
+                       feature_indices=None, chunk_size=None):
+    """
+    Fit a ridge (or least squares) regression to each of many weighted subsets of the 
+    same data at once, e.g. the bootstrap samples of a bagging ensemble. The fit of 
+    each subset depends only on the weighted sums X'WX and X'Wy, which are computed for
+    all subsets with matrix products, and the coefficients are obtained with a single
+    stacked solve. The solutions are those of sklearn's Ridge (or LinearRegression if 
+    alpha is 0) fitted with sample_weight, or fitted to the subsets with duplicated 
+    rows.
+    
+    Parameters
+    ------------
+    X : array-like
+        Features of the data with shape (n_samples, n_features).
+    y : array-like
+        The target values.
+    counts : ndarray
+        Weights of the samples in each subset (e.g. number of times each sample is 
+        drawn), with shape (n_subsets, n_samples).
+    alpha : float (default=0.0)
+        Regularization strength. If 0, the minimum norm least squares solution is 
+        returned.
+    fit_intercept : bool (default=True)
+        Whether to fit an intercept (by centering X and y with the weighted means of 
+        each subset).
+    feature_indices : ndarray or None (default=None)
+        Indices of the features used by each subset, with shape (n_subsets, 
+        n_features used). Other features have zero coefficients. If None, all features 
+        are used.
+    chunk_size : int or None (default=None)
+        Number of samples for which products of features are computed at once. If None,
+        chunks are chosen to hold at most 2**22 products.
+    
+    Returns
+    ---------
+    (coef, intercept) : tuple
+        Coefficients of each subset, with shape (n_subsets, n_features), and intercepts
+        with shape (n_subsets,).
+    """
+    
+    X = np.asarray(X, dtype=np.float64)
+    y = np.squeeze(np.asarray(y, dtype=np.float64))
+    counts = np.asarray(counts, dtype=np.float64)
+    (n, d), m = X.shape, len(counts)
+    assert counts.shape==(m, n), 'counts must have shape (n_subsets, n_samples)'
+    if chunk_size is None:
+        chunk_size = max(1, 2**22 // (d * d))
+    
+    # Center with the overall means to reduce cancellation
+    X_mean = np.mean(X, axis=0) if fit_intercept else np.zeros(d)
+    y_mean = np.mean(y) if fit_intercept else 0.0
+    X, y = X - X_mean, y - y_mean
+    
+    # Weighted sums of all subsets
+    w = np.sum(counts, axis=1)
+    XtWX = np.zeros((m, d * d))
+    for i in range(0, n, chunk_size):
+        X_chunk = X[i:i+chunk_size]
+        products = (X_chunk[:,:,None] * X_chunk[:,None,:]).reshape(len(X_chunk), d * d)
+        XtWX += counts[:,i:i+chunk_size] @ products
+    XtWX = XtWX.reshape(m, d, d)
+    XtWy = counts @ (X * y[:,None])
+    if fit_intercept:
+        # Center with the weighted means of each subset
+        X_offset, y_offset = (counts @ X) / w[:,None], (counts @ y) / w
+        XtWX -= w[:,None,None] * X_offset[:,:,None] * X_offset[:,None,:]
+        XtWy -= w[:,None] * X_offset * y_offset[:,None]
+    
+    # Stacked solve of the normal equations (of the features of each subset)
+    if feature_indices is not None:
+        feature_indices = np.asarray(feature_indices)
+        rows = np.arange(m)[:,None]
+        XtWX = XtWX[rows[:,:,None], feature_indices[:,:,None], feature_indices[:,None,:]]
+        XtWy = XtWy[rows, feature_indices]
+    if alpha > 0:
+        XtWX += alpha * np.eye(XtWX.shape[1])
+        coef = np.linalg.solve(XtWX, XtWy[:,:,None])[:,:,0]
+    else:
+        coef = (np.linalg.pinv(XtWX, hermitian=True) @ XtWy[:,:,None])[:,:,0]
+    if feature_indices is not None:
+        coef_all = np.zeros((m, d))
+        coef_all[rows, feature_indices] = coef
+        coef = coef_all
+    
+    intercept = np.zeros(m)
+    if fit_intercept:
+        intercept = y_mean + y_offset - np.sum((X_offset + X_mean) * coef, axis=1)
+    return coef, intercept
+
+
+
+
+
+
+class KernelCache():
+    """
+    Cache of RBF kernel (Gram) matrices, keyed by the fingerprint of the data matrix 
+    and gamma, so that a Gram matrix is computed once and shared by all regressors 
+    fitted to subsets of the same data (e.g. the regressors of a Rebagg ensemble, and 
+    ensembles with different C in a grid search). The least recently used matrices are 
+    evicted when the total size of the stored matrices exceeds max_memory. The cache is 
+    shared rather than copied when regressors holding it are copied (or cloned), and 
+    the stored matrices are not pickled.
+    
+    Parameters
+    ------------
+    max_memory : float (default=1024)
+        Maximum total size (in megabytes) of the stored Gram matrices. Matrices larger 
+        than max_memory are computed but not stored.
+    
+    Attributes
+    ------------
+    hits : int
+        Number of requests served from the cache.
+    misses : int
+        Number of requests that required computing a Gram matrix.
+    
+    Examples
+    ----------
+    >>> cache = KernelCache(max_memory=512)
+    >>> for C in [0.1, 1, 10]:
+    ...     rebagg = Rebagg(m=100, s=600, base_reg=CachedKernelSVR(C=C, gamma=0.01, 
+    ...                                                             kernel_cache=cache))
+    ...     rebagg.fit(X_train, y_train, relevance, random_state=0)
+    """
+    
+    
+    
+    
+    def __init__(self, max_memory=1024):
+        if max_memory <= 0:
+            raise ValueError("max_memory must be positive")
+        self.max_memory = max_memory
+        self.hits, self.misses = 0, 0
+        self._grams = OrderedDict()
+        self._lock = threading.Lock()
+    
+    
+    
+    
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_grams'] = OrderedDict()
+        return state
+    
+    
+    
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+    
+    
+    
+    
+    def __deepcopy__(self, memo):
+        return self
+    
+    
+    
+    
+    def get(self, X, gamma):
+        """
+        Return the RBF kernel matrix of X, exp(-gamma * ||x_i - x_j||^2), computing and 
+        storing it if it is not in the cache. The returned matrix is read-only.
+        """
+        
+        X = np.asarray(X, dtype=np.float64)
+        key = (array_fingerprint(X), float(gamma))
+        with self._lock:
+            gram = self._grams.get(key)
+            if gram is not None:
+                self._grams.move_to_end(key)
+                self.hits += 1
+                return gram
+            self.misses += 1
+        
+        gram = rbf_kernel(X, gamma=gamma)
+        gram.flags.writeable = False
+        if gram.nbytes > self.max_memory * 2**20:
+            return gram
+        with self._lock:
+            self._grams[key] = gram
+            self._grams.move_to_end(key)
+            while sum(g.nbytes for g in self._grams.values()) > self.max_memory * 2**20:
+                self._grams.popitem(last=False)  # Evict least recently used
+        return gram
+    
+    
+    
+    
+    def clear(self):
+        """Remove all Gram matrices from the cache"""
+        
+        with self._lock:
+            self._grams.clear()
+
+
+
+
+class CachedKernelSVR(BaseEstimator, RegressorMixin):
+    """
+    Epsilon-support vector regression with an RBF kernel, fitted with a precomputed 
+    Gram matrix (sklearn.svm.SVR with kernel='precomputed') that may be taken from a
+    KernelCache. Rebagg computes the Gram matrix of the training data once if the base
+    regressor is a CachedKernelSVR, and fits each regressor to the rows and columns of 
+    the samples it draws. The fitted regressors are those of SVR(kernel='rbf') up to 
+    rounding of the kernel values.
+    
+    Parameters
+    ------------
+    C : float (default=1.0)
+        Regularization parameter (see sklearn.svm.SVR).
+    epsilon : float (default=0.1)
+        Width of the epsilon-tube (see sklearn.svm.SVR).
+    gamma : float or 'scale' (default='scale')
+        Coefficient of the RBF kernel. If 'scale', 1 / (n_features * X.var()) of the 
+        data the regressor is fitted to (Rebagg then computes a Gram matrix for each 
+        regressor, since gamma differs between regressors).
+    tol : float (default=1e-3)
+        Tolerance for the stopping criterion.
+    shrinking : bool (default=True)
+        Whether to use the shrinking heuristic.
+    max_iter : int (default=-1)
+        Limit on the iterations of the solver, or -1 for no limit.
+    kernel_cache : KernelCache or None (default=None)
+        Cache of Gram matrices, shared by regressors fitted to the same data. If None, 
+        Gram matrices are computed for each fit (or once for each Rebagg fit).
+    
+    Attributes
+    ------------
+    support_vectors_ : ndarray
+        Support vectors (rows of X), used to compute the kernel of new samples.
+    dual_coef_ : ndarray
+        Coefficients of the support vectors in the decision function.
+    intercept_ : float
+        Constant in the decision function.
+    gamma_ : float
+        Coefficient of the RBF kernel used in fitting.
+    """
+    
+    
+    
+    
+    def __init__(self, C=1.0, epsilon=0.1, gamma='scale', tol=1e-3, shrinking=True, 
+                 max_iter=-1, kernel_cache=None):
+        self.C = C
+        self.epsilon = epsilon
+        self.gamma = gamma
+        self.tol = tol
+        self.shrinking = shrinking
+        self.max_iter = max_iter
+        self.kernel_cache = kernel_cache
+    
+    
+    
+    
+    def _gamma(self, X):
+        """Return the coefficient of the RBF kernel for data X"""
+        
+        if isinstance(self.gamma, str):
+            if self.gamma != 'scale':
+                raise ValueError("gamma must be a float or 'scale'")
+            X_var = X.var()
+            return 1.0 / (X.shape[1] * X_var) if X_var != 0 else 1.0
+        return float(self.gamma)
+    
+    
+    
+    
+    def fit(self, X, y, sample_weight=None):
+        """Compute (or retrieve from kernel_cache) the Gram matrix of X and fit the 
+        regressor"""
+        
+        X = np.asarray(X, dtype=np.float64)
+        gamma = self._gamma(X)
+        if self.kernel_cache is not None:
+            gram = self.kernel_cache.get(X, gamma)
+        else:
+            gram = rbf_kernel(X, gamma=gamma)
+        return self.fit_gram(gram, X, y, gamma, sample_weight=sample_weight)
+    
+    
+    
+    
+    def fit_gram(self, gram, X, y, gamma, sample_weight=None):
+        """
+        Fit the regressor with a precomputed Gram matrix.
+        
+        Parameters
+        ------------
+        gram : ndarray
+            RBF kernel matrix of X with coefficient gamma, with shape (n_samples, 
+            n_samples).
+        X : array-like
+            Features of the data, of which the support vectors are kept for prediction.
+        y : array-like
+            The target values.
+        gamma : float
+            Coefficient of the RBF kernel of gram.
+        sample_weight : array-like or None (default=None)
+            Weights of the samples (multiplying C), e.g. the number of times each 
+            sample is drawn.
+        
+        Returns
+        --------
+        self : CachedKernelSVR
+        """
+        
+        X = np.asarray(X, dtype=np.float64)
+        svr = SVR(kernel='precomputed', C=self.C, epsilon=self.epsilon, tol=self.tol, 
+                  shrinking=self.shrinking, max_iter=self.max_iter)
+        svr.fit(gram, np.squeeze(np.asarray(y, dtype=np.float64)), 
+                sample_weight=sample_weight)
+        self.support_vectors_ = X[svr.support_]
+        self.dual_coef_ = svr.dual_coef_[0]
+        self.intercept_ = float(svr.intercept_[0])
+        self.gamma_ = gamma
+        self.n_features_in_ = X.shape[1]
+        return self
+    
+    
+    
+    
+    def predict(self, X):
+        """Predict target values for X"""
+        
+        X = np.asarray(X, dtype=np.float64)
+        return rbf_kernel(X, self.support_vectors_, gamma=self.gamma_) @ self.dual_coef_ \
+               + self.intercept_
+
+
+
+
+
+
+class ElasticNetPath(BaseEstimator, RegressorMixin):
+    """
+    Elastic net regressions for a grid of regularization strengths (alphas), fitted 
+    with a single pass of coordinate descent along the decreasing alphas, in which the
+    fit of each alpha is started from the coefficients of the previous (larger) alpha
+    (sklearn.linear_model.enet_path). The coefficients of each alpha are those of 
+    sklearn.linear_model.ElasticNet(alpha) up to the tolerance of coordinate descent.
+    
+    The predictions of all alphas are returned as the columns of a multi-output 
+    prediction, so that a Rebagg ensemble of ElasticNetPath regressors predicts with 
+    the ensembles of all alphas at once.
+    
+    Parameters
+    ------------
+    alphas : array-like
+        Regularization strengths. Columns of predictions are in the order of alphas.
+    l1_ratio : float (default=0.5)
+        Mixing parameter of the L1 and L2 penalties (see ElasticNet).
+    fit_intercept : bool (default=True)
+        Whether to fit an intercept (by centering X and y).
+    max_iter : int (default=1000)
+        Maximum number of iterations of coordinate descent for each alpha.
+    tol : float (default=1e-4)
+        Tolerance of coordinate descent (see ElasticNet).
+    
+    Attributes
+    ------------
+    coef_ : ndarray
+        Coefficients of each alpha, with shape (n_alphas, n_features).
+    intercept_ : ndarray
+        Intercepts of each alpha, with shape (n_alphas,).
+    
+    Examples
+    ----------
+    >>> rebagg = Rebagg(m=100, s=600, base_reg=ElasticNetPath(alphas=[0.01, 0.1, 1]))
+    >>> rebagg.fit(X_train, y_train, relevance)
+    >>> y_pred = rebagg.predict(X_test)  # Shape (n_samples, 3)
+    """
+    
+    
+    
+    
+    def __init__(self, alphas, l1_ratio=0.5, fit_intercept=True, max_iter=1000, 
+                 tol=1e-4):
+        self.alphas = alphas
+        self.l1_ratio = l1_ratio
+        self.fit_intercept = fit_intercept
+        self.max_iter = max_iter
+        self.tol = tol
+    
+    
+    
+    
+    def fit(self, X, y):
+        """Fit the coefficients of all alphas"""
+        
+        X = np.asarray(X, dtype=np.float64)
+        y = np.squeeze(np.asarray(y, dtype=np.float64))
+        alphas = np.asarray(self.alphas, dtype=np.float64)
+        if np.any(alphas <= 0):
+            raise ValueError('alphas must be positive')
+        X_offset = np.mean(X, axis=0) if self.fit_intercept else np.zeros(X.shape[1])
+        y_offset = np.mean(y) if self.fit_intercept else 0.0
+        order = np.argsort(-alphas, kind='stable')
+        path_alphas, coefs, dual_gaps = enet_path(X - X_offset, y - y_offset, 
+                                                  l1_ratio=self.l1_ratio, 
+                                                  alphas=alphas[order], precompute=False,
+                                                  max_iter=self.max_iter, tol=self.tol)
+        self.coef_ = np.empty((len(alphas), X.shape[1]))
+        self.coef_[order] = coefs.T
+        self.intercept_ = y_offset - self.coef_ @ X_offset
+        self.n_features_in_ = X.shape[1]
+        return self
+    
+    
+    
+    
+    def predict(self, X):
+        """Predict target values for X with each alpha, as an array with shape 
+        (n_samples, n_alphas)"""
+        
+        return np.asarray(X, dtype=np.float64) @ self.coef_.T + self.intercept_
+
+
+
+
+
+
+def _neighbor_means(dist, counts, y, ks, n_candidates):
+    """Return the mean target values (y) of the ks nearest neighbors of each row of dist
+    (distances to the samples) in each subset of samples with multiplicities counts 
+    (shape (n_samples, n_subsets)), as an array with shape (len(dist), n_subsets, 
+    len(ks)). Only the n_candidates nearest samples are searched, or more for rows 
+    where they contain fewer than max(ks) samples of a subset."""
+    
+    (b, n), m = dist.shape, counts.shape[1]
+    if n_candidates < n:
+        nearest = np.argpartition(dist, n_candidates - 1, axis=1)[:, :n_candidates]
+        nearest.sort(axis=1)  # Equal distances in the order of the samples
+    else:
+        nearest = np.tile(np.arange(n), (b, 1))
+    order = np.argsort(np.take_along_axis(dist, nearest, axis=1), axis=1, kind='stable')
+    nearest = np.take_along_axis(nearest, order, axis=1).T  # (candidates, rows)
+    
+    # Multiplicities of the candidates in each subset (candidates, rows, subsets)
+    c = counts[nearest]
+    cum_c = np.cumsum(c, axis=0)
+    y_nearest = y[nearest]
+    cum_cy = np.cumsum(c * y_nearest[:,:,None], axis=0)
+    short = np.any(cum_c[-1] < np.max(ks), axis=1)
+    
+    y_pred = np.empty((b, m, len(ks)))
+    for j, k in enumerate(ks):
+        # Position of the k-th neighbor, of which only k - cum_before copies count
+        pos = np.minimum(np.sum(cum_c < k, axis=0), len(nearest) - 1)[None]
+        c_pos = np.take_along_axis(c, pos, axis=0)[0]
+        cum_pos = np.take_along_axis(cum_c, pos, axis=0)[0]
+        cy_pos = np.take_along_axis(cum_cy, pos, axis=0)[0]
+        y_pos = y_nearest[pos[0], np.arange(b)[:,None]]
+        y_pred[:, :, j] = (cy_pos - c_pos * y_pos + (k - cum_pos + c_pos) * y_pos) / k
+    if np.any(short):
+        y_pred[short] = _neighbor_means(dist[short], counts, y, ks, 
+                                        min(n, 2 * n_candidates))
+    return y_pred
+
+
+
+
+def predict_neighbor_members(X_train, y_train, counts, X, n_neighbors, max_memory=256):
+    """
+    Predict target values for X with many k-nearest neighbors regressors (uniform 
+    weights, Euclidean distance) fitted to subsets of the same training data with 
+    repeated samples, e.g. the bootstrap samples of a bagging ensemble. Distances are 
+    computed once between X and the unique training samples of all subsets, and the 
+    neighbors of each subset are found by accumulating its multiplicities (counts) 
+    along the nearest samples. All numbers of neighbors in n_neighbors are predicted 
+    from a single search for the largest number of neighbors. Predictions are those of
+    sklearn's KNeighborsRegressor fitted to each subset, up to ties in distances.
+    
+    Parameters
+    ------------
+    X_train : array-like
+        Features of the training data with shape (n_samples, n_features).
+    y_train : array-like
+        Target values of the training data.
+    counts : ndarray
+        Number of times each training sample is in each subset, with shape 
+        (n_subsets, n_samples).
+    X : array-like
+        Features of the samples to predict.
+    n_neighbors : int or array-like
+        Number(s) of neighbors.
+    max_memory : float (default=256)
+        Approximate maximum size (in megabytes) of the arrays computed for a block of 
+        samples of X at once.
+    
+    Returns
+    ---------
+    y_pred : ndarray
+        Predicted values with shape (n_subsets, len(X)) if n_neighbors is an int, or 
+        (n_subsets, len(X), len(n_neighbors)) otherwise.
+    """
+    
+    X_train = np.asarray(X_train, dtype=np.float64)
+    y_train = np.squeeze(np.asarray(y_train, dtype=np.float64))
+    X = np.asarray(X, dtype=np.float64)
+    counts = np.asarray(counts)
+    ks = np.atleast_1d(n_neighbors).astype(np.intp)
+    k_max = int(np.max(ks))
+    if np.any(ks < 1):
+        raise ValueError('n_neighbors must be positive')
+    if np.any(np.sum(counts, axis=1) < k_max):
+        raise ValueError('n_neighbors must not exceed the number of samples of a subset')
+    
+    # Unique training samples of all subsets
+    rows = np.flatnonzero(np.any(counts > 0, axis=0))
+    X_rows, y_rows, counts = X_train[rows], y_train[rows], counts[:, rows]
+    (m, n), n_pred = counts.shape, len(X)
+    
+    # Nearest candidates searched, enough for the subset with fewest samples on 
+    # average (more are searched for samples of X where they are not enough)
+    n_candidates = min(n, int(np.ceil(2 * k_max * n / np.min(np.sum(counts, axis=1)))))
+    block_size = int(max_memory * 2**20 / (8 * (n + 4 * m * n_candidates)))
+    block_size = min(max(block_size, 1), max(n_pred, 1))
+    counts = np.ascontiguousarray(counts.T)  # (samples, subsets)
+    
+    y_pred = np.empty((n_pred, m, len(ks)))
+    for start in range(0, n_pred, block_size):
+        dist = cdist(X[start:start+block_size], X_rows)
+        y_pred[start:start+block_size] = _neighbor_means(dist, counts, y_rows, ks, 
+                                                         n_candidates)
+    y_pred = y_pred.transpose(1, 0, 2)
+    
+    return y_pred[:, :, 0] if np.ndim(n_neighbors)==0 else y_pred
+
+
+
+
+def _shares_neighbors(reg):
+    """Return True if reg is a k-nearest neighbors regressor whose predictions can be 
+    computed with predict_neighbor_members"""
+    
+    if isinstance(reg, KNeighborsPath):
+        return True
+    if type(reg) is not KNeighborsRegressor:
+        return False
+    euclidean = reg.metric=='euclidean' or (reg.metric=='minkowski' and reg.p==2)
+    return euclidean and reg.weights=='uniform' and reg.metric_params is None
+
+
+
+
+class KNeighborsPath(BaseEstimator, RegressorMixin):
+    """
+    k-nearest neighbors regression (uniform weights, Euclidean distance) for one or 
+    several numbers of neighbors, predicted from a single search for the largest 
+    number of neighbors (see predict_neighbor_members). For several numbers of 
+    neighbors, the predictions of each are returned as the columns of a multi-output 
+    prediction, as in ElasticNetPath, and the standard deviations, quantiles, and 
+    out-of-bag predictions of a Rebagg ensemble have the same columns.
+    
+    Sample weights are numbers of repeats of the samples, so that fitting with the 
+    number of times each sample is drawn is equivalent to fitting with repeated 
+    samples. Rebagg fits each regressor to the counts of the rows it draws, without 
+    copying rows, and predicts with all regressors from a single distance computation.
+    
+    Parameters
+    ------------
+    n_neighbors : int or array-like (default=5)
+        Number(s) of neighbors.
+    max_memory : float (default=256)
+        Approximate maximum size (in megabytes) of the arrays computed at once in 
+        predict.
+    
+    Examples
+    ----------
+    >>> rebagg = Rebagg(m=100, s=600, base_reg=KNeighborsPath(n_neighbors=[5, 10, 15]))
+    >>> rebagg.fit(X_train, y_train, relevance)
+    >>> y_pred = rebagg.predict(X_test)  # Shape (n_samples, 3)
+    """
+    
+    
+    
+    
+    def __init__(self, n_neighbors=5, max_memory=256):
+        self.n_neighbors = n_neighbors
+        self.max_memory = max_memory
+    
+    
+    
+    
+    def fit(self, X, y, sample_weight=None):
+        """Store the training data, with the number of repeats of each sample in 
+        sample_weight (integers, default 1)"""
+        
+        self.X_fit_ = np.asarray(X, dtype=np.float64)
+        self.y_fit_ = np.squeeze(np.asarray(y, dtype=np.float64))
+        if sample_weight is None:
+            self.counts_ = np.ones(len(self.y_fit_), dtype=np.int32)
+        else:
+            self.counts_ = np.asarray(sample_weight).astype(np.int32)
+            if np.any(self.counts_ != sample_weight) or np.any(self.counts_ < 0):
+                raise ValueError('sample_weight must be non-negative integers')
+        if np.sum(self.counts_) < np.max(self.n_neighbors):
+            raise ValueError('n_neighbors must not exceed the number of samples')
+        self.n_features_in_ = self.X_fit_.shape[1]
+        return self
+    
+    
+    
+    
+    def predict(self, X):
+        """Predict target values for X, as an array with shape (n_samples,) if 
+        n_neighbors is an int, or (n_samples, len(n_neighbors)) otherwise"""
+        
+        return predict_neighbor_members(self.X_fit_, self.y_fit_, self.counts_[None], X,
+                                        self.n_neighbors, max_memory=self.max_memory)[0]
+
+
+
+
+
+
+def _inbag_mask(indices, n_samples):
+    """Return a boolean array of length n_samples that is True at indices"""
+    
+    inbag = np.zeros(n_samples, dtype=bool)
+    inbag[np.asarray(indices, dtype=int)] = True
+    return inbag
+
+
+
+
+def _expand_to(a, b):
+    """Append axes of length 1 to a, so that it broadcasts against b along the leading 
+    axes of b (e.g. against the outputs of multi-output regressors)"""
+    
+    a = np.asarray(a)
+    return a.reshape(a.shape + (1,) * (np.ndim(b) - a.ndim))
+
+
+
+
+def _check_single_output(y_ensemble, method):
+    """Raise a ValueError if the regressors of an ensemble predict several values per 
+    sample, i.e. if y_ensemble from Rebagg.predict_all has more than two dimensions"""
+    
+    if np.ndim(y_ensemble) > 2:
+        raise ValueError(f'{method} requires regressors that predict a single value per '
+                         f'sample, but the regressors predict {y_ensemble.shape[2]} '
+                         'values (e.g. ElasticNetPath or KNeighborsPath). Fit the '
+                         'ensemble with a single alpha or n_neighbors.')
+
+
+
+
+def _r2_rows(y_true, y_pred):
+    """R2 score of each row of predictions, y_pred (n_rows, n_samples), ignoring NaN"""
+    
+    valid = ~np.isnan(y_pred)
+    n_valid = valid.sum(axis=1)
+    y_mean = np.sum(y_true * valid, axis=1) / n_valid
+    ss_res = np.nansum((y_true - y_pred)**2, axis=1)
+    ss_tot = np.sum(valid * (y_true - y_mean[:,None])**2, axis=1)
+    return 1 - ss_res/ss_tot
+
+
+
+
+def _mse_rows(y_true, y_pred):
+    """Mean squared error of each row of predictions, y_pred, ignoring NaN"""
+    
+    return np.nanmean((y_true - y_pred)**2, axis=1)
+
+
+
+
+def _mcc_rows(y_true, y_pred, bins):
+    """Matthew's correlation coefficient (see matthews_corrcoef) of each row of 
+    predictions, y_pred, ignoring NaN"""
+    
+    valid = ~np.isnan(y_pred)
+    n_rows, n_bins = len(y_pred), len(bins) + 1
+    bins_true = np.digitize(y_true, bins)
+    bins_pred = np.digitize(np.where(valid, y_pred, bins[0]), bins)
+    cells = np.arange(n_rows)[:,None] * n_bins**2 + bins_true * n_bins + bins_pred
+    confusion = np.bincount(cells.ravel(), weights=valid.ravel(), 
+                            minlength=n_rows*n_bins**2)
+    confusion = confusion.reshape(n_rows, n_bins, n_bins)
+    n_true, n_pred = confusion.sum(axis=2), confusion.sum(axis=1)
+    n_correct = np.trace(confusion, axis1=1, axis2=2)
+    n = valid.sum(axis=1)
+    cov_ytyp = n_correct * n - np.sum(n_true * n_pred, axis=1)
+    cov_ypyp = n**2 - np.sum(n_pred**2, axis=1)
+    cov_ytyt = n**2 - np.sum(n_true**2, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mcc = cov_ytyp / np.sqrt(cov_ytyt * cov_ypyp)
+    mcc[~np.isfinite(mcc)] = 0
+    return mcc
+
+
+
+
+def _f1_rows(y_true, y_pred, error_threshold, relevance_func, relevance_threshold, k):
+    """F1 score (see f1_score) of each row of predictions, y_pred, ignoring NaN. 
+    Relevance values are computed with relevance_func for each row."""
+    
+    valid = ~np.isnan(y_pred)
+    relevance_true = np.zeros(y_pred.shape)
+    relevance_pred = np.zeros(y_pred.shape)
+    for i in range(len(y_pred)):
+        # Relevance functions such as sigmoid_relevance depend on all values passed
+        if np.all(valid[i]):
+            relevance_true[i] = relevance_func(y_true)
+            relevance_pred[i] = relevance_func(y_pred[i])
+        else:
+            relevance_true[i, valid[i]] = relevance_func(y_true[valid[i]])
+            relevance_pred[i, valid[i]] = relevance_func(y_pred[i, valid[i]])
+    relevance_true = relevance_true * (relevance_true >= relevance_threshold)
+    relevance_pred = relevance_pred * (relevance_pred >= relevance_threshold)
+    error = np.abs(y_true - np.where(valid, y_pred, np.inf))  # See accuracy_function
+    acc_function = (error <= error_threshold) * \
+                   (1 - np.exp(-k/error_threshold**2 * (error - error_threshold)**2))
+    acc_function[~valid] = 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.sum(acc_function * relevance_pred, axis=1) / \
+                    np.sum(relevance_pred, axis=1)
+        recall = np.sum(acc_function * relevance_true, axis=1) / \
+                 np.sum(relevance_true, axis=1)
+        f1 = 2 * precision * recall / (precision + recall)
+    f1[~(f1 > 0)] = 0
+    return f1
+
+
+
+
+
+
+class Rebagg():
+    """
+    Rebagg implements resampled bagging to deal with data imbalance in regression 
+    problems. Each regressor in the bagging ensemble is fitted to a resampled dataset. 
+    Resampling may be implemented by random oversampling, SMOTER, addition of Gaussian 
+    noise, or the WERCS algorithm.
+    
+    Parameters
+    ------------
+    m : int (default=100)
+        Number of models (regressors) in the ensemble
+    s : int or float (default=0.5)
+        Number of bootstrap samples drawn to fit the base regressors. If int, then *s* 
+        samples are drawn. If float, then *X.shape[0] * s* samples are drawn.
+    base_reg : scikit-learn regressor or None, optional (default=None)
+        The base regressor to fit random subsets of the dataset. If None, then *base_reg* 
+        is a decision tree with default settings. If a Ridge or LinearRegression 
+        regressor (with positive=False) and sample_method is 'random_oversample', all 
+        regressors are fitted at once from the weighted sums of their rows (see 
+        fit_linear_members), without copying rows. If a 
+        CachedKernelSVR with a float gamma, the Gram matrix of X is computed once (or 
+        taken from its kernel_cache) and sliced for each regressor. If a 
+        KNeighborsPath, or a KNeighborsRegressor with uniform weights and Euclidean 
+        distance, all regressors predict from the distances to the unique training 
+        rows, computed once (see predict_neighbor_members).
+    n_jobs : int or None, optional (default=None)
+        Number of regressors fitted in parallel. If None, regressors are fitted 
+        sequentially. If -1, all processors are used. Each regressor samples and fits 
+        its dataset in a worker, so that at most n_jobs resampled datasets exist at 
+        once. The fitted ensemble is the same for any value of n_jobs.
+    backend : str, {'threads' | 'processes'} or None, optional (default=None)
+        Whether regressors are fitted in parallel threads or processes. Threads avoid
+        copying data to workers, but are only faster if the base regressor releases the
+        GIL during fitting. If None, threads are used if base_reg is a decision tree, 
+        and processes otherwise.
+    weight_duplicates : bool, optional (default=False)
+        If True, each regressor is fitted to the unique rows drawn from the dataset, 
+        with sample weights equal to the number of times each row is drawn, rather than
+        to a dataset with duplicated rows. This reduces the memory and time for fitting
+        each regressor. Requires sample_method='random_oversample' and a base regressor 
+        that accepts sample_weight in its fit method. For regressors that minimize a sum
+        of per-sample losses, fitting with weights is equivalent to fitting with 
+        duplicated rows in exact arithmetic: linear models (e.g. Ridge or ElasticNet) 
+        differ by rounding errors, SVR with a float gamma differs within the tolerance 
+        of the solver (tol), and KNeighborsPath is identical. Decision trees with the 
+        same random_state predict the drawn rows identically, but splits of a node on
+        different features that decrease the impurity equally (frequent in nodes of few
+        distinct rows) are chosen by rounding errors, which differ between weighted and
+        repeated sums, so that other samples may be predicted differently by each tree.
+        Fits are not equivalent if a parameter counts rows rather than weights, e.g. 
+        min_samples_split > 2 or min_samples_leaf > 1 of decision trees (use 
+        min_weight_fraction_leaf instead), or gamma='scale' of SVR, which is computed 
+        from the variance of the unique rows.
+    oob_score : bool, optional (default=False)
+        If True, the out-of-bag predictions and R2 score of the training data are 
+        computed after fitting (see oob_prediction_ and oob_score_).
+    max_features : int, float or None, optional (default=None)
+        Number of features (columns of X) randomly drawn for each regressor (random 
+        subspaces). If int, max_features features are drawn. If float, 
+        max(1, int(max_features * n_features)) features are drawn. If None, all features
+        are used. The features of each regressor are stored in feature_indices, and 
+        selected from X for both fitting and predicting.
+    warm_start : bool, optional (default=False)
+        If True, calling fit on a fitted ensemble keeps the fitted regressors and only 
+        fits m - len(fitted_regs) new regressors, seeded from the same random stream as
+        the first fit. The ensemble is then the same as if it had been fitted with the 
+        larger m from scratch. The data and resampling parameters passed to fit must not
+        change.
+    quantize_bins : int or None, optional (default=None)
+        If not None, base_reg is a decision tree, and sample_method is 
+        'random_oversample', X is coarsely quantized once in fit into at most 
+        quantize_bins bins of each feature (see quantize_features), and each tree is 
+        fitted to the bins of the rows it draws, so that fewer distinct values are 
+        sorted at each node. The thresholds of the fitted trees are then replaced with 
+        the thresholds of the bins, so that the trees predict from X. The memory used 
+        per tree is unchanged (each tree is fitted to a float32 copy of the bins of its
+        rows, as scikit-learn copies X), and the trees are still grown by scikit-learn,
+        which sorts the rows at each node. The trees differ from trees fitted to X if a
+        feature has more than quantize_bins distinct values, or values that are not 
+        drawn for a tree.
+   
+    Attributes
+    ------------
+    fitted_regs : list
+        A list of base regressors which have been fitted to bootstrap samples of the 
+        dataset.
+    feature_indices : ndarray or None
+        Indices of the features used by each regressor, with shape (m, n_features used),
+        or None if max_features is None.
+    inbag_ : ndarray of uint8
+        Bitsets of the training samples used by each regressor (in-bag samples), packed 
+        with np.packbits into an array with shape (m, ceil(n_samples/8)). A training 
+        sample is in-bag if it is drawn, or if it is used to generate synthetic samples 
+        (with SMOTER or Gaussian noise, all samples of the rare domain are in-bag when 
+        the rare domain is oversampled). Use the inbag_mask method to unpack.
+    oob_prediction_ : ndarray
+        Mean prediction of the training samples by the regressors for which they are 
+        out-of-bag (NaN if a sample is in-bag for all regressors). Only available if 
+        oob_score is True.
+    oob_score_ : float or ndarray
+        R2 score of the out-of-bag predictions of the training samples, or an array of 
+        the scores of each output if the regressors predict several values per sample 
+        (e.g. ElasticNetPath). Only available if oob_score is True.
+    pred_std : ndarray
+        An array of the standard deviation of predicted values after calling the predict
+        method (with return_std=False).
+    n_members_used : int
+        Number of regressors evaluated in the last call of the predict method (fewer 
+        than m if max_members or time_budget is given).
+    linear_coef_ : ndarray or None
+        Coefficients of all features of each regressor, with shape (m, n_features), if
+        the regressors are fitted at once with fit_linear_members (and None otherwise).
+        Used by predict to predict with all regressors in a single matrix product.
+    linear_intercept_ : ndarray or None
+        Intercepts of the regressors, if linear_coef_ is not None.
+    neighbor_counts_ : ndarray or None
+        Number of times each training sample is drawn by each regressor, with shape 
+        (m, n_samples), if the base regressor is a nearest neighbors regressor fitted 
+        to drawn rows (and None otherwise). Used by predict to predict with all 
+        regressors from a single distance computation (see predict_neighbor_members).
+    packed_trees : PackedTrees or None
+        Decision trees of the ensemble packed into flat arrays after calling the 
+        pack_trees method, and used by predict to traverse all trees at once (in n_jobs
+        threads). None if the trees are not packed.
+        
+    References
+    -----------
+    ..  [1] Branco, P., Torgo, L., Ribeiro, R.P. (2018). Rebagg: Resampled bagging for 
+        imbalanced regression.
+    
+    Examples
+    ----------
+    >>> from sklearn.neighbors import KNeighborsRegressor
+    >>> knreg = KNeighborsRegressor(n_neighbors=10)
+    >>> #
+    >>> # Initialize an ensemble of 50 KNN regressors, with each base regressor fitted to
+    >>> # a resampled dataset of 200 samples
+    >>> #
+    >>> rebagg = Rebagg(m=50, s=200, base_reg=knreg) 
+    >>> rebagg.fit(X_train, y_train) # Resample dataset and fit base regressors
+    >>> y_pred = rebagg.predict(X_test)
+    >>> y_std = rebagg.pred_std  # Standard deviation of ensemble predictions
+    
+    """
+    
+    
+    
+    
+    def __init__(self, m=100, s=0.5, base_reg=None, n_jobs=None, backend=None, 
+                 weight_duplicates=False, oob_score=False, warm_start=False, 
+                 max_features=None, quantize_bins=None):
+        self.m = m
+        if type(s) not in [int, float]:
+            raise TypeError("s must be int or float")
+        self.s = s
+        if base_reg is not None:
+            self.base_reg = base_reg
+        else:
+            self.base_reg = DecisionTreeRegressor()
+        if backend not in (None, 'threads', 'processes'):
+            raise ValueError("backend must be 'threads', 'processes', or None")
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.weight_duplicates = weight_duplicates
+        self.oob_score = oob_score
+        self.warm_start = warm_start
+        self.max_features = max_features
+        self.quantize_bins = quantize_bins
+        self._isfitted = False
+        
+        
+
+    
+    def sample(self, X, y, relevance, relevance_threshold, 
+               sample_method='random_oversample', size_method='balance', k=5, delta=0.1, 
+               over=0.5, under=0.5, nominal=None, nominal_freqs=None, 
+               neighbor_algorithm='brute', neighbor_cache=None, vectorize=False, 
+               return_inbag=False, random_state=None):
+        """ 
+        Resample dataset and return a smaller balanced dataset for fitting a single 
+        regressor in the ensemble.
+        
+        Parameters
+        ------------
+        X : array-like or sparse matrix 
+            Features of the data.
+        y : array-like
+            The target values.
+        relevance : 1d array-like
             Values ranging from 0 to 1 that indicate the relevance of target values. 
         relevance_threshold : float
             Threshold of relevance for forming rare and normal domains. Target values with 
@@ -1628,9 +3317,28 @@ class Rebagg():
             or 'wercs-gn'.  Indicates the fraction of samples removed in undersampling.
         nominal : ndarray (default=None)
             Column indices of nominal features. If None, then all features are continuous.
-        random_state : int or None, optional (default=None)
+        nominal_freqs : dict or None (default=None)
+            Values and frequencies of nominal features in the rare domain, as returned by
+            nominal_frequencies, used if sample_method is 'gaussian'. If None, they are
+            computed from the rare domain.
+        neighbor_algorithm : str, {'brute' | 'kd_tree' | 'ball_tree'} (default='brute')
+            Algorithm used to search for nearest neighbors if sample_method is 'smoter'
+            (see get_neighbors).
+        neighbor_cache : NeighborCache or None (default=None)
+            Cache of nearest neighbors used if sample_method is 'smoter'. If None, 
+            neighbors are computed without caching.
+        vectorize : bool (default=False)
+            If True and sample_method is 'smoter', synthetic samples are generated at 
+            once with array operations (see smoter_interpolate).
+        return_inbag : bool (default=False)
+            If True, also return a boolean array of length n_samples that is True for 
+            the samples of X used to generate the resampled dataset (see inbag_).
+        random_state : int, None, Generator or SeedSequence, optional (default=None)
             If int, random_state is the seed used by the random number generator. If None, 
-            the random number generator is the RandomState instance used by np.random.
+            the random number generator is seeded with fresh entropy. If 
+            np.random.Generator, random numbers are drawn from it, and if 
+            np.random.SeedSequence, from a new Generator. The global state of np.random is
+            not used (see check_random_state).
         
     
         
@@ -1638,86 +3346,222 @@ class Rebagg():
         --------
         [X_reg, y_reg] : list
             List contanining features (X_reg) and target values (y_reg) of resampled 
-            dataset for fitting a single regressor in the ensemble.
+            dataset for fitting a single regressor in the ensemble. If return_inbag is 
+            True, [X_reg, y_reg, inbag].
         """
         
         X, y = np.asarray(X), np.squeeze(np.asarray(y))
         relevance = np.squeeze(np.asarray(relevance))
         assert len(y)==len(X), ('X and y do not have the same number of samples')
         assert len(y)==len(relevance), 'y and relevance must be of the same length'
+        domains = None
+        if sample_method in ('random_oversample', 'smoter', 'gaussian'):
+            domains = self._domains(X, y, relevance, relevance_threshold, sample_method)
         
-        if type(self.s) == float:
-            size = int(self.s * X.shape[0])
-        elif type(self.s) == int:
-            size = self.s
-            
-        np.random.seed(seed=random_state)
+        return self._sample(X, y, relevance, domains, sample_method=sample_method, 
+                            size_method=size_method, k=k, delta=delta, over=over, 
+                            under=under, nominal=nominal, nominal_freqs=nominal_freqs, 
+                            neighbor_algorithm=neighbor_algorithm, 
+                            neighbor_cache=neighbor_cache, vectorize=vectorize,
+                            return_inbag=return_inbag, random_state=random_state)
+    
+    
+    
+    
+    def _domains(self, X, y, relevance, relevance_threshold, sample_method):
+        """Return the indices of the rare and normal domains (and the features, target 
+        values, and relevance of the rare domain if sample_method is 'smoter' or 
+        'gaussian'), which are computed once for all regressors in fit"""
         
-        if sample_method in ('random_oversample', 'smoter', 'gaussian'):
-            # Split target values to rare and normal domains
-            X_norm_all, y_norm_all, X_rare_all, y_rare_all = split_domains(X, y, 
-                            relevance=relevance, relevance_threshold=relevance_threshold)
-            relevance_rare = relevance[np.where(relevance >= relevance_threshold)]
-           
-            # Sample sizes
-            if size_method=='balance':
-                s_rare = int(size/2)
-                s_norm = size - s_rare
-            elif size_method=='variation':
-                p = np.random.choice([1/3, 2/5, 1/2, 2/5, 2/3])
-                s_rare = int(size * p)
-                s_norm = int(size - s_rare)
-            else:
-                raise ValueError('Wrong value of size_method specified')
+        rare_indices = np.where(relevance >= relevance_threshold)[0]
+        norm_indices = np.where(relevance < relevance_threshold)[0]
+        assert len(rare_indices) < len(norm_indices), ('Rare domain must be smaller than '
+                  'normal domain. Adjust your relevance values or relevance threshold so '
+                  'that the there are fewer samples in the rare domain.')
+        domains = dict(rare_indices=rare_indices, norm_indices=norm_indices, 
+                       n_samples=len(y))
+        if sample_method in ('smoter', 'gaussian'):
+            domains.update(X_rare=X[rare_indices,:], y_rare=y[rare_indices], 
+                           relevance_rare=relevance[rare_indices])
+        return domains
+    
+    
+    
+    
+    def _sample(self, X, y, relevance, domains, sample_method='random_oversample', 
+                size_method='balance', k=5, delta=0.1, over=0.5, under=0.5, nominal=None,
+                nominal_freqs=None, neighbor_algorithm='brute', neighbor_cache=None, 
+                vectorize=False, return_inbag=False, random_state=None):
+        """Resample the dataset with the precomputed domains (see the sample method)"""
+        
+        if sample_method=='random_oversample':
+            indices = self._sample_indices(domains, size_method, random_state)
+            if return_inbag:
+                return [X[indices,:], y[indices], _inbag_mask(indices, len(y))]
+            return [X[indices,:], y[indices]]
+        
+        size = self._sample_size(len(y))
+        rng = check_random_state(random_state)
+        
+        if sample_method in ('smoter', 'gaussian'):
+            rare_all_indices = domains['rare_indices']
+            X_rare_all, y_rare_all = domains['X_rare'], domains['y_rare']
+            relevance_rare = domains['relevance_rare']
+            s_rare, s_norm = self._domain_sizes(size, size_method, rng)
             
             # Sample rare data
             if s_rare <= len(y_rare_all):
-                rare_indices = np.random.choice(range(len(y_rare_all)), s_rare, 
-                                               replace=False) # No oversampling
+                rare_indices = rng.choice(len(y_rare_all), s_rare, 
+                                          replace=False) # No oversampling
                 X_rare, y_rare = X_rare_all[rare_indices,:], y_rare_all[rare_indices]
+                source_indices = rare_all_indices[rare_indices]
             else:
-                if sample_method=='random_oversample':
-                    rare_indices = np.random.choice(range(len(y_rare_all)), s_rare,
-                                                    replace=True) # Duplicate samples
-                    X_rare, y_rare = X_rare_all[rare_indices,:], y_rare_all[rare_indices]
-                elif sample_method=='smoter':
+                source_indices = rare_all_indices  # All rare samples are used
+                if sample_method=='smoter':
+                    nested_state = _nested_random_state(random_state, rng, 0)
                     X_rare, y_rare = oversample(X_rare_all, y_rare_all, size=s_rare,
                                                 method='smoter', k=k, 
                                                 relevance=relevance_rare, nominal=nominal,
-                                                random_state=random_state)
+                                                neighbor_algorithm=neighbor_algorithm,
+                                                neighbor_cache=neighbor_cache,
+                                                vectorize=vectorize,
+                                                random_state=nested_state)
                 elif sample_method=='gaussian':
+                    nested_state = _nested_random_state(random_state, rng, 0)
                     X_rare, y_rare = oversample(X_rare_all, y_rare_all, size=s_rare,
                                                 method='gaussian', delta=delta, 
                                                 relevance=relevance_rare, nominal=nominal,
-                                                random_state=random_state)
+                                                nominal_freqs=nominal_freqs,
+                                                random_state=nested_state)
             # Sample normal data
-            norm_indices = np.random.choice(range(len(y_norm_all)), s_norm, replace=True)
+            norm_indices = rng.choice(len(domains['norm_indices']), s_norm, replace=True)
             X_norm, y_norm = X[norm_indices,:], y[norm_indices]
             
             # Combine rare and normal samles
             X_reg = np.append(X_rare, X_norm, axis=0)
             y_reg = np.append(y_rare, y_norm, axis=0)
+            source_indices = np.append(source_indices, norm_indices)
             
         elif sample_method in ['wercs', 'wercs-gn']:
             noise = True if sample_method=='wercs-gn' else False
-            X_reg, y_reg = wercs(X, y, relevance=relevance, over=over, under=under, 
-                                 noise=noise, delta=delta, nominal=nominal, 
-                                 random_state=random_state)
-            sample_indices = np.random.choice(range(len(y_reg)), size=size, 
-                                              replace=(size>len(y_reg)))
+            nested_state = _nested_random_state(random_state, rng, 0)
+            X_reg, y_reg, source_indices = wercs(X, y, relevance=relevance, over=over,
+                                                 under=under, noise=noise, delta=delta, 
+                                                 nominal=nominal, return_indices=True,
+                                                 random_state=nested_state)
+            sample_indices = rng.choice(len(y_reg), size=size, replace=(size>len(y_reg)))
             X_reg, y_reg = X_reg[sample_indices,:], y_reg[sample_indices]
+            source_indices = source_indices[sample_indices]
+        
+        else:
+            raise ValueError("Wrong value of sample_method")
+        
+        if return_inbag:
+            return [X_reg, y_reg, _inbag_mask(source_indices, len(y))]
+        return [X_reg, y_reg]
+    
+    
+    
+    
+    def sample_indices(self, X, y, relevance, relevance_threshold, size_method='balance',
+                       random_state=None):
+        """
+        Return the indices of the rows of X drawn by random oversampling (i.e. 
+        sample_method='random_oversample') for fitting a single regressor in the 
+        ensemble, without copying the rows. X[indices,:] is the same as the dataset 
+        returned by the sample method with the same random_state. See the sample method 
+        for a description of the parameters.
+        """
+        
+        y = np.squeeze(np.asarray(y))
+        relevance = np.squeeze(np.asarray(relevance))
+        assert len(y)==len(X), ('X and y do not have the same number of samples')
+        assert len(y)==len(relevance), 'y and relevance must be of the same length'
+        domains = self._domains(X, y, relevance, relevance_threshold, 'random_oversample')
+        return self._sample_indices(domains, size_method, random_state)
+    
+    
+    
+    
+    def _sample_indices(self, domains, size_method, random_state):
+        """Return the indices drawn by random oversampling with the precomputed domains
+        (see the sample_indices method)"""
+        
+        rare_all_indices = domains['rare_indices']
+        rng = check_random_state(random_state)
+        s_rare, s_norm = self._domain_sizes(self._sample_size(domains['n_samples']), 
+                                            size_method, rng)
+        
+        # Sample rare data (duplicate samples if the rare domain is smaller than s_rare)
+        rare_indices = rng.choice(len(rare_all_indices), s_rare, 
+                                  replace=(s_rare > len(rare_all_indices)))
+        
+        # Sample normal data (indices of rows of X, as in the sample method)
+        norm_indices = rng.choice(len(domains['norm_indices']), s_norm, replace=True)
+        
+        return np.append(rare_all_indices[rare_indices], norm_indices)
+    
+    
+    
+    
+    def _sample_size(self, n_samples):
+        """Return the number of samples drawn for fitting each regressor"""
         
+        if type(self.s) == float:
+            return int(self.s * n_samples)
+        elif type(self.s) == int:
+            return self.s
+    
+    
+    
+    
+    def _domain_sizes(self, size, size_method, rng):
+        """Return the number of samples drawn from the rare and normal domains"""
+        
+        if size_method=='balance':
+            s_rare = int(size/2)
+            s_norm = size - s_rare
+        elif size_method=='variation':
+            p = rng.choice([1/3, 2/5, 1/2, 2/5, 2/3])
+            s_rare = int(size * p)
+            s_norm = int(size - s_rare)
         else:
-            raise ValueError("Wrong value of sample_method")
+            raise ValueError('Wrong value of size_method specified')
+        return s_rare, s_norm
+    
+    
+    
+    
+    def _n_member_features(self, n_features):
+        """Return the number of features drawn for each regressor (None if all)"""
         
+        max_features = getattr(self, 'max_features', None)
+        if max_features is None:
+            return None
+        elif type(max_features) == float and 0 < max_features <= 1:
+            return max(1, int(max_features * n_features))
+        elif type(max_features) == int and 1 <= max_features <= n_features:
+            return max_features
+        raise ValueError(f'max_features must be None, a float in (0, 1], or an int in '
+                         f'[1, {n_features}]')
+    
+    
+    
+    
+    def _member_X(self, i, X):
+        """Return the columns of X used by the i-th regressor"""
         
-        return [X_reg, y_reg]
+        feature_indices = getattr(self, 'feature_indices', None)
+        if feature_indices is None:
+            return X
+        return np.asarray(X)[:,feature_indices[i]]
     
     
     
     
     def fit(self, X, y, relevance, relevance_threshold=0.5, sample_method='random_oversample',
             size_method='balance', k=5, delta=0.1, over=0.5, under=0.5, nominal=None, 
+            neighbor_algorithm='brute', neighbor_cache=None, vectorize=False, 
             random_state=None):
         """ 
         Fit an ensemble of regressors to randomly drawn samples from the training set.
@@ -1778,9 +3622,23 @@ class Rebagg():
             or 'wercs-gn'.  Indicates the fraction of samples removed in undersampling.
         nominal : ndarray (default=None)
             Column indices of nominal features. If None, then all features are continuous.
-        random_state : int or None, optional (default=None)
-            If int, random_state is the seed used by the random number generator. If None, 
-            the random number generator is the RandomState instance used by np.random.
+        neighbor_algorithm : str, {'brute' | 'kd_tree' | 'ball_tree'} (default='brute')
+            Algorithm used to search for nearest neighbors if sample_method is 'smoter'
+            (see get_neighbors).
+        neighbor_cache : NeighborCache or None (default=None)
+            Cache of nearest neighbors used if sample_method is 'smoter'. If None, a
+            cache is created for the fit, so that neighbors of the rare domain are 
+            computed only once for all regressors in the ensemble.
+        vectorize : bool (default=False)
+            If True and sample_method is 'smoter', synthetic samples are generated at 
+            once with array operations (see smoter_interpolate).
+        random_state : int, None, Generator or SeedSequence, optional (default=None)
+            Seed of the np.random.SeedSequence from which an independent random number 
+            generator is spawned for each regressor in the ensemble (see 
+            seed_sequence). Base regressors with random_state=None are also seeded from
+            the stream of each regressor. The global state of np.random is not used. 
+            Ignored when new regressors are added with warm_start, which continue the
+            stream of the first fit.
         
         Returns
         --------
@@ -1797,51 +3655,1075 @@ class Rebagg():
                        sample_method='smoter', size_method='balance', k=5)
         """
         
-        regressors = [copy.deepcopy(self.base_reg) for i in range(self.m)]
-        np.random.seed(seed=random_state)
-        random_states = np.random.choice(range(2*self.m), size=self.m)
-        for i in range(self.m):
-            # Bootstrap samples
-            X_reg, y_reg = self.sample(X, y, relevance, relevance_threshold, sample_method,
-                                       size_method, k, delta, over, under, nominal,
-                                       random_states[i])
-            # Fit regressor to samples
-            regressors[i].fit(X_reg, y_reg)
-        self.fitted_regs = regressors
+        n_fitted = 0
+        if getattr(self, 'warm_start', False) and self._isfitted:
+            n_fitted = len(self.fitted_regs)
+            if self.m < n_fitted:
+                raise ValueError(f'm={self.m} must be larger or equal to the number of '
+                                 f'fitted regressors ({n_fitted}) when warm_start is True')
+            if getattr(self, '_seed_seq', None) is None or \
+               getattr(self, 'inbag_', None) is None:
+                raise ValueError('This ensemble cannot be warm started. Refit the '
+                                 'ensemble.')
+            if self._n_inbag != len(np.squeeze(np.asarray(y))):
+                raise ValueError('warm_start requires the same training data as the '
+                                 'first fit')
+            if self.m == n_fitted:
+                warnings.warn('Fitting with warm_start=True and no new regressors '
+                              '(increase m to add regressors)')
+                return
+        
+        if getattr(self, 'weight_duplicates', False):
+            if sample_method!='random_oversample':
+                raise ValueError("weight_duplicates requires sample_method to be "
+                                 "'random_oversample'")
+            if not has_fit_parameter(self.base_reg, 'sample_weight'):
+                raise ValueError("weight_duplicates requires a base regressor that "
+                                 "accepts sample_weight")
+        if sample_method not in ('random_oversample', 'smoter', 'gaussian', 'wercs', 
+                                 'wercs-gn'):
+            raise ValueError("Wrong value of sample_method")
+        X, y = np.asarray(X), np.squeeze(np.asarray(y))
+        relevance = np.squeeze(np.asarray(relevance))
+        assert len(y)==len(X), ('X and y do not have the same number of samples')
+        assert len(y)==len(relevance), 'y and relevance must be of the same length'
+        
+        # Domains and sampling tables, shared by all regressors
+        domains = None
+        if sample_method in ('random_oversample', 'smoter', 'gaussian'):
+            domains = self._domains(X, y, relevance, relevance_threshold, sample_method)
+        if sample_method=='smoter' and neighbor_cache is None:
+            neighbor_cache = NeighborCache(max_entries=1)
+        nominal_freqs = None
+        if sample_method=='gaussian' and nominal is not None:
+            nominal_freqs = nominal_frequencies(domains['X_rare'], nominal)
+        if sample_method=='smoter':
+            # Compute neighbors of the rare domain before the cache is sent to workers
+            neighbor_cache.get(domains['X_rare'], k, algorithm=neighbor_algorithm)
+        sample_kwargs = dict(sample_method=sample_method, size_method=size_method, k=k, 
+                             delta=delta, over=over, under=under, nominal=nominal, 
+                             nominal_freqs=nominal_freqs, 
+                             neighbor_algorithm=neighbor_algorithm, 
+                             neighbor_cache=neighbor_cache, vectorize=vectorize)
+        if n_fitted == 0:
+            # Independent stream for each regressor, kept for warm starts
+            self._seed_seq = seed_sequence(random_state)
+        member_seqs = [child_seed_sequence(self._seed_seq, i) \
+                       for i in range(n_fitted, self.m)]
+        
+        # Draw the features of all regressors (from a stream separate from the rows). 
+        # Children of the stream of each regressor: 0 for features, 1 for rows, and 2 
+        # for the random_state of the regressor
+        member_features = [None] * len(member_seqs)
+        n_features = self._n_member_features(X.shape[1])
+        if n_fitted > 0 and (n_features is None) != \
+                            (getattr(self, 'feature_indices', None) is None):
+            raise ValueError('max_features must not change when warm_start is True')
+        if n_features is not None:
+            member_features = np.array([np.sort(np.random.default_rng(
+                                            child_seed_sequence(member_seq, 0)).choice(
+                                            X.shape[1], n_features, replace=False)) \
+                                        for member_seq in member_seqs], dtype=np.intp)
+        
+        # Draw the rows of all regressors (m x s) before fitting, if random oversampling
+        member_indices = [None] * len(member_seqs)
+        if sample_method=='random_oversample':
+            member_indices = np.empty((len(member_seqs), self._sample_size(len(y))), 
+                                      dtype=np.int32)
+            for i, member_seq in enumerate(member_seqs):
+                rng = np.random.default_rng(child_seed_sequence(member_seq, 1))
+                member_indices[i] = self._sample_indices(domains, size_method, rng)
+        
+        # Data shared by the regressors fitted to drawn rows: X quantized once for 
+        # decision trees, or the Gram matrix of X for kernel SVR
+        shared = None
+        if sample_method=='random_oversample' and \
+           getattr(self, 'quantize_bins', None) is not None and \
+           isinstance(self.base_reg, BaseDecisionTree):
+            shared = quantize_features(X, max_bins=self.quantize_bins)
+        elif sample_method=='random_oversample' and n_features is None and \
+             isinstance(self.base_reg, CachedKernelSVR) and \
+             not isinstance(self.base_reg.gamma, str):
+            kernel_cache = self.base_reg.kernel_cache
+            if kernel_cache is None:
+                shared = rbf_kernel(X.astype(np.float64), gamma=self.base_reg.gamma)
+            else:
+                shared = kernel_cache.get(X, self.base_reg.gamma)
+        
+        # Fit regressors (in parallel if n_jobs is not None), or solve all linear 
+        # regressors at once
+        fitted_regs = self.fitted_regs if n_fitted > 0 else []
+        self.fitted_regs = []  # Do not send previously fitted regressors to workers
+        alpha = _linear_alpha(self.base_reg)
+        coef = intercept = None
+        neighbor_counts = None
+        if sample_method=='random_oversample' and alpha is not None:
+            features = None if n_features is None else member_features
+            members, coef, intercept = self._fit_linear_members(X, y, member_indices, 
+                                                                features, alpha)
+        elif sample_method=='random_oversample' and n_features is None and \
+             _shares_neighbors(self.base_reg):
+            members, neighbor_counts = self._fit_neighbor_members(X, y, member_indices)
+        else:
+            backend = self.backend
+            if backend is None:
+                is_shared = isinstance(self.base_reg, (BaseDecisionTree, 
+                                                       CachedKernelSVR))
+                backend = 'threads' if is_shared else 'processes'
+            parallel = Parallel(n_jobs=self.n_jobs, prefer=backend, pre_dispatch='n_jobs')
+            members = parallel(delayed(self._fit_member)(X, y, relevance, domains, 
+                                                    sample_kwargs, member_seq, indices,
+                                                    features, shared) \
+                               for member_seq, indices, features in zip(member_seqs, 
+                                                    member_indices, member_features))
+        self.fitted_regs = fitted_regs + [reg for (reg, inbag) in members]
+        inbag = np.array([inbag for (reg, inbag) in members], dtype=np.uint8)
+        if n_fitted > 0:
+            inbag = np.append(self.inbag_, inbag, axis=0)
+        self.inbag_ = inbag
+        self._n_inbag = len(y)
+        if n_features is None:
+            self.feature_indices = None
+        elif n_fitted > 0:
+            self.feature_indices = np.append(self.feature_indices, member_features, 
+                                             axis=0)
+        else:
+            self.feature_indices = member_features
+        self._n_features = X.shape[1]
+        if coef is None or (n_fitted > 0 and getattr(self, 'linear_coef_', None) is None):
+            self.linear_coef_, self.linear_intercept_ = None, None
+        elif n_fitted > 0:
+            self.linear_coef_ = np.append(self.linear_coef_, coef, axis=0)
+            self.linear_intercept_ = np.append(self.linear_intercept_, intercept)
+        else:
+            self.linear_coef_, self.linear_intercept_ = coef, intercept
+        if neighbor_counts is None or \
+           (n_fitted > 0 and getattr(self, 'neighbor_counts_', None) is None):
+            self.neighbor_counts_, self._neighbor_data = None, None
+        elif n_fitted > 0:
+            self.neighbor_counts_ = np.append(self.neighbor_counts_, neighbor_counts, 
+                                              axis=0)
+        else:
+            self.neighbor_counts_ = neighbor_counts
+            self._neighbor_data = (np.asarray(X, dtype=np.float64), 
+                                   np.asarray(y, dtype=np.float64))
+        self.packed_trees = None
         self._isfitted=True
         
+        if getattr(self, 'oob_score', False):
+            self.oob_prediction_ = self.oob_predict(X)
+            finite = np.isfinite(self.oob_prediction_)
+            if finite.ndim > 1:
+                finite = np.all(finite, axis=1)
+            if not np.all(finite):
+                warnings.warn('Some samples are in-bag for all regressors; they are not '
+                              'used to compute oob_score_. Increase m or decrease s.')
+            y_oob = self.oob_prediction_[finite]
+            if y_oob.ndim > 1:
+                # One score for each output of multi-output regressors
+                self.oob_score_ = metrics.r2_score(
+                        np.broadcast_to(np.asarray(y)[finite][:,None], y_oob.shape), 
+                        y_oob, multioutput='raw_values')
+            else:
+                self.oob_score_ = metrics.r2_score(y[finite], y_oob)
+        
         
         
         
-    def predict(self, X):
+    def _fit_member(self, X, y, relevance, domains, sample_kwargs, member_seq, 
+                    indices=None, features=None, shared=None):
+        """Resample the dataset and fit a single regressor with independent children of
+        member_seq (a np.random.SeedSequence) for the rows and the regressor, or fit 
+        the rows of X drawn in indices if not None. Only the columns of X in features 
+        are used if not None. If shared is not None, it is the output of 
+        quantize_features for X (to fit a decision tree to the bins of the drawn rows),
+        or the Gram matrix of X (to fit a CachedKernelSVR to its rows and columns of the
+        drawn rows). Return the regressor and the bitset of in-bag samples."""
+        
+        reg = copy.deepcopy(self.base_reg)
+        set_random_state(reg, child_seed_sequence(member_seq, 2))
+        columns = slice(None) if features is None else features
+        if indices is None:
+            rng = np.random.default_rng(child_seed_sequence(member_seq, 1))
+            X_reg, y_reg, inbag = self._sample(X, y, relevance, domains, **sample_kwargs,
+                                               return_inbag=True, random_state=rng)
+            reg.fit(X_reg[:,columns], y_reg)
+        elif isinstance(reg, BaseDecisionTree) and shared is not None:
+            # Tree fitted to the bins of the drawn rows (or of the unique rows weighted
+            # by the number of times they are drawn)
+            X_binned, bin_thresholds = shared
+            rows, weights = indices, None
+            if getattr(self, 'weight_duplicates', False):
+                weights = np.bincount(indices, minlength=len(y))
+                rows = np.flatnonzero(weights)
+                weights = weights[rows]
+            if features is not None:
+                X_binned = X_binned[np.ix_(rows, features)]
+                bin_thresholds = [bin_thresholds[j] for j in features]
+            else:
+                X_binned = X_binned[rows]
+            reg.fit(X_binned.astype(np.float32), y[rows], sample_weight=weights)
+            _unbin_tree(reg, bin_thresholds)
+            inbag = _inbag_mask(indices, len(y))
+        elif isinstance(reg, CachedKernelSVR) and shared is not None:
+            # Rows and columns of the drawn rows in the Gram matrix
+            rows, weights = indices, None
+            if getattr(self, 'weight_duplicates', False):
+                weights = np.bincount(indices, minlength=len(y))
+                rows = np.flatnonzero(weights)
+                weights = weights[rows]
+            reg.fit_gram(shared[np.ix_(rows, rows)], X[rows], y[rows], reg.gamma, 
+                         sample_weight=weights)
+            inbag = _inbag_mask(indices, len(y))
+        elif getattr(self, 'weight_duplicates', False):
+            # Fit unique rows weighted by the number of times they are drawn
+            counts = np.bincount(indices, minlength=len(y))
+            unique = np.flatnonzero(counts)
+            X_reg = X[unique,:] if features is None else X[np.ix_(unique, features)]
+            reg.fit(X_reg, y[unique], sample_weight=counts[unique])
+            inbag = counts > 0
+        else:
+            # Rows (and columns) are copied only in the worker
+            X_reg = X[indices,:] if features is None else X[np.ix_(indices, features)]
+            reg.fit(X_reg, y[indices])
+            inbag = _inbag_mask(indices, len(y))
+        return reg, np.packbits(inbag)
+    
+    
+    
+    
+    def _fit_linear_members(self, X, y, member_indices, member_features, alpha):
+        """Fit linear regressors (Ridge or LinearRegression) to the rows drawn in 
+        member_indices with a single stacked solve (see fit_linear_members). Return the 
+        regressors with their bitsets of in-bag samples, and the coefficients (of all 
+        features) and intercepts of the regressors."""
+        
+        (m, s), n = member_indices.shape, len(y)
+        keys = np.arange(m)[:,None] * n + member_indices
+        counts = np.bincount(keys.ravel(), minlength=m*n).reshape(m, n)
+        coef, intercept = fit_linear_members(X, y, counts, alpha=alpha, 
+                                             fit_intercept=self.base_reg.fit_intercept,
+                                             feature_indices=member_features)
+        members = []
+        for i in range(m):
+            reg = copy.deepcopy(self.base_reg)
+            columns = slice(None) if member_features is None else member_features[i]
+            reg.coef_ = coef[i, columns].copy()
+            reg.intercept_ = intercept[i] if reg.fit_intercept else 0.0
+            reg.n_features_in_ = len(reg.coef_)
+            members.append((reg, np.packbits(counts[i] > 0)))
+        return members, coef, intercept
+    
+    
+    
+    
+    def _fit_neighbor_members(self, X, y, member_indices):
+        """Fit nearest neighbors regressors to the rows drawn in member_indices. A 
+        KNeighborsPath is fitted to the counts of the rows, and a KNeighborsRegressor 
+        to the drawn rows. Return the regressors with their 
+        bitsets of in-bag samples, and the counts of the rows of each regressor, with
+        which predict_all predicts for all regressors at once."""
+        
+        (m, s), n = member_indices.shape, len(y)
+        keys = np.arange(m)[:,None] * n + member_indices
+        counts = np.bincount(keys.ravel(), minlength=m*n).reshape(m, n).astype(np.int32)
+        X_float = np.asarray(X, dtype=np.float64)
+        members = []
+        for i in range(m):
+            reg = copy.deepcopy(self.base_reg)
+            if isinstance(reg, KNeighborsPath):
+                # References X rather than copying rows
+                reg.fit(X_float, y, sample_weight=counts[i])
+            else:
+                reg.fit(X[member_indices[i]], y[member_indices[i]])
+            members.append((reg, np.packbits(counts[i] > 0)))
+        return members, counts
+    
+    
+    
+    
+    def inbag_mask(self):
+        """
+        Return a boolean array with shape (m, n_samples) that is True where a training 
+        sample is in-bag for a regressor (i.e. the unpacked bitsets of inbag_).
+        """
+        
+        if not self._isfitted:
+            raise ValueError('Rebagg ensemble has not yet been fitted to training data.')
+        if getattr(self, 'inbag_', None) is None:
+            raise ValueError('In-bag samples were not recorded for this ensemble. Refit '
+                             'the ensemble.')
+        return np.unpackbits(self.inbag_, axis=1, count=self._n_inbag).astype(bool)
+    
+    
+    
+    
+    def oob_predict(self, X):
+        """
+        Predict the training samples with the regressors for which they are out-of-bag.
+        
+        Parameters
+        -----------
+        X : array-like
+            Features of the training data, in the same order as passed to fit.
+        
+        Returns
+        --------
+        y : ndarray of shape (n_samples,) or (n_samples, n_outputs)
+            Mean out-of-bag prediction of each training sample. NaN if the sample is 
+            in-bag for all regressors.
+        """
+        
+        oob = ~self.inbag_mask()
+        assert oob.shape[1]==len(X), ('X must be the training data passed to fit')
+        y_ensemble = self.predict_all(X)
+        n_oob = oob.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            y = np.where(_expand_to(oob, y_ensemble), y_ensemble, 0.0).sum(axis=0) / \
+                _expand_to(n_oob, y_ensemble[0])
+        return y
+    
+    
+    
+    
+    def jackknife_variance(self, X, bias_correction=True):
+        """
+        Estimate the variance of the ensemble prediction for X with the 
+        jackknife-after-bootstrap [1]. For each training sample i, the mean prediction 
+        of the regressors for which i is out-of-bag, t_(-i), is compared with the 
+        ensemble prediction, t,
+        
+            V = (n - 1)/n * sum_i (t_(-i) - t)^2
+            
+        which requires no refitting. Training samples that are in-bag for all 
+        regressors are omitted from the sum.
+        
+        Parameters
+        -----------
+        X : array-like or sparse matrix 
+            Features of the data.
+        bias_correction : bool (default=True)
+            If True, subtract the Monte Carlo bias of a finite ensemble of m regressors,
+            (n - 1)/n * sum_i (1/m_i - 1/m) * var_b(t_b), where m_i is the number of 
+            regressors for which sample i is out-of-bag and var_b(t_b) is the variance 
+            of the predictions of the regressors. For bootstrap samples of size n, this 
+            is the correction, (e - 1) * n/m * var_b(t_b), of [1]. Negative variances 
+            are set to zero.
+        
+        Returns
+        --------
+        variance : ndarray of shape (n_samples,) or (n_samples, n_outputs)
+            Estimated variance of the predicted target values.
+        
+        References
+        -----------
+        ..  [1] Wager, S., Hastie, T., and Efron, B. (2014). Confidence intervals for 
+            random forests: the jackknife and the infinitesimal jackknife. Journal of 
+            Machine Learning Research, 15, 1625-1651.
+        """
+        
+        oob = ~self.inbag_mask()
+        n_oob = oob.sum(axis=0)
+        oob = oob[:, n_oob > 0].astype(float)
+        n_oob = n_oob[n_oob > 0]
+        n = self._n_inbag
+        y_ensemble = self.predict_all(X)
+        y_mean = np.mean(y_ensemble, axis=0)
+        y_jack = np.tensordot(oob.T, y_ensemble, axes=1) / \
+                 _expand_to(n_oob, y_ensemble)  # t_(-i), (n_oob, n_samples)
+        variance = (n - 1)/n * np.sum((y_jack - y_mean)**2, axis=0)
+        if bias_correction:
+            bias = (n - 1)/n * np.sum(1/n_oob - 1/len(y_ensemble))
+            variance -= bias * np.var(y_ensemble, axis=0)
+            variance = np.maximum(variance, 0)
+        return variance
+    
+    
+    
+    
+    def pack_trees(self):
+        """
+        Pack the fitted decision trees into flat arrays (see PackedTrees), so that 
+        predict traverses all trees at once. Packing is fastest for predicting small 
+        batches of samples, or large batches in several threads (n_jobs). It may also be
+        called on ensembles fitted (and saved) with earlier versions of Rebagg.
+        """
+        
+        if not self._isfitted:
+            raise ValueError('Rebagg ensemble has not yet been fitted to training data.')
+        is_tree = [isinstance(reg, DecisionTreeRegressor) and reg.n_outputs_==1 \
+                   for reg in self.fitted_regs]
+        if not all(is_tree):
+            raise ValueError('Only ensembles of single-output decision trees can be packed')
+        self.packed_trees = PackedTrees(self.fitted_regs, 
+                                        getattr(self, 'feature_indices', None),
+                                        getattr(self, '_n_features', None))
+    
+    
+    
+    
+    def predict_all(self, X):
+        """
+        Return the target values predicted by each regressor in the ensemble for X, as 
+        an array with shape (m, n_samples), or (m, n_samples, n_outputs) if each 
+        regressor predicts several values per sample (e.g. ElasticNetPath or 
+        KNeighborsPath).
+        """
+        
+        if not self._isfitted:
+            raise ValueError('Rebagg ensemble has not yet been fitted to training data.')
+        
+        return self._predict_members(X)
+    
+    
+    
+    
+    def _predict_members(self, X, start=0, stop=None):
+        """Return the target values predicted for X by the regressors 
+        fitted_regs[start:stop], as in predict_all, with the packed trees, stacked 
+        linear coefficients or shared neighbor search of the ensemble if available"""
+        
+        members = slice(start, stop)
+        packed_trees = getattr(self, 'packed_trees', None)
+        if packed_trees is not None:
+            return packed_trees.predict_all(X, n_jobs=getattr(self, 'n_jobs', None),
+                                            trees=members)
+        if getattr(self, 'linear_coef_', None) is not None:
+            return self.linear_coef_[members] @ np.asarray(X, dtype=np.float64).T + \
+                   self.linear_intercept_[members,None]
+        if getattr(self, 'neighbor_counts_', None) is not None:
+            X_train, y_train = self._neighbor_data
+            return predict_neighbor_members(X_train, y_train, 
+                                            self.neighbor_counts_[members], X, 
+                                            self.fitted_regs[0].n_neighbors)
+        indices = range(len(self.fitted_regs))[members]
+        return np.array([self.fitted_regs[i].predict(self._member_X(i, X)) \
+                         for i in indices])
+    
+    
+    
+    
+    def predict_anytime(self, X, max_members=None, time_budget=None, chunk_size=1024,
+                        max_memory=256):
+        """
+        Predict target values for X with the regressors of the ensemble in a fixed order 
+        (that of fitted_regs), and stop early once max_members regressors are evaluated
+        or the time budget is spent. Regressors are evaluated with the same predictor as
+        predict_all (so that packed trees, stacked linear regressors, and the shared 
+        neighbor search are used). 
+        
+        Without a time budget, the regressors are evaluated for blocks of chunk_size 
+        samples at a time, so that only the predictions for one block are held at once.
+        With a time budget, the regressors are evaluated in batches for all samples, and
+        the mean and standard deviation of the predicted values are updated after each
+        batch (Welford's algorithm, merged for batches), so the partial predictions are 
+        available at any time. The first batch is a single regressor, and each further 
+        batch at most doubles the number of regressors evaluated.
+        
+        Parameters
+        -----------
+        X : array-like or sparse matrix 
+            Features of the data.
+        max_members : int or None (default=None)
+            Maximum number of regressors evaluated. If None, all regressors are 
+            evaluated unless the time budget is spent.
+        time_budget : float or None (default=None)
+            Time in seconds allowed for prediction. No further regressor is evaluated if
+            it is expected to exceed the budget, based on the mean time taken by the 
+            regressors evaluated so far. At least one regressor is always evaluated.
+        chunk_size : int (default=1024)
+            Number of samples in each block if time_budget is None.
+        max_memory : float (default=256)
+            Approximate maximum size (in megabytes) of the predictions of a batch of 
+            regressors if time_budget is not None, including all outputs of 
+            multi-output regressors.
+        
+        Returns
+        --------
+        (y, y_std, n_members) : tuple
+            The predicted target values (mean of the regressors evaluated), the standard
+            deviation of the values predicted by the regressors evaluated, and the 
+            number of regressors evaluated.
+        
+        Examples
+        ----------
+        >>> # Predict within 5 ms with no more than 50 regressors
+        >>> y_pred, y_std, n = rebagg.predict_anytime(X_test, max_members=50, 
+        ...                                           time_budget=0.005)
+        """
+        
+        if not self._isfitted:
+            raise ValueError('Rebagg ensemble has not yet been fitted to training data.')
+        if max_members is not None and max_members < 1:
+            raise ValueError('max_members must be a positive integer or None')
+        if not hasattr(X, 'shape'):
+            X = np.asarray(X)
+        n_regs = len(self.fitted_regs[:max_members])
+        if time_budget is None:
+            y, y_std = [], []
+            for i in range(0, X.shape[0], chunk_size):
+                y_ensemble = self._predict_members(X[i:i+chunk_size], stop=n_regs)
+                y.append(np.mean(y_ensemble, axis=0))
+                y_std.append(np.std(y_ensemble, axis=0))
+            return np.concatenate(y), np.concatenate(y_std), n_regs
+        
+        batch = 1
+        start = time.perf_counter()
+        n = 0
+        while n < n_regs:
+            stop = min(n + batch, n_regs)
+            y_batch = self._predict_members(X, n, stop)
+            n_batch = stop - n
+            y_mean = np.mean(y_batch, axis=0)
+            m2_batch = np.sum((y_batch - y_mean)**2, axis=0)
+            if n == 0:
+                y, m2 = y_mean, m2_batch
+                # Size of the predictions of a regressor (samples and outputs)
+                max_batch = max(int(max_memory * 2**20 / (8 * max(y_mean.size, 1))), 1)
+            else:
+                delta = y_mean - y
+                y = y + delta * n_batch/stop
+                m2 = m2 + m2_batch + delta**2 * n * n_batch/stop
+            n = stop
+            if n < n_regs:
+                elapsed = time.perf_counter() - start
+                # Regressors expected to be evaluated within the remaining time
+                n_left = int((time_budget - elapsed) * n/elapsed) if elapsed > 0 else n
+                if n_left < 1:
+                    break
+                batch = min(n_left, n, max_batch)
+        assert y.shape[0]==X.shape[0], ('X and y do not have the same number of samples')
+        
+        return y, np.sqrt(m2/n), n
+    
+    
+    
+    
+    def predict(self, X, return_std=False, quantiles=None, max_members=None, 
+                time_budget=None):
         """
         Predict target values for X. The predicted target value is the mean of all values
-        predicted by each regressor in the ensemble. The standard deviation of the 
-        predicted values can be obtained by the attribute, `pred_std`.
+        predicted by each regressor in the ensemble. 
+        
+        If return_std is True or quantiles are given, the standard deviation (or 
+        quantiles) of the predicted values is returned, and the ensemble is not modified,
+        so that a fitted ensemble can predict in several threads at once. The mean and 
+        standard deviation are then computed for blocks of 1024 samples at a time (or 
+        updated after each batch of regressors with a time budget, see predict_anytime),
+        so that the predictions of all regressors for all samples are not held at once.
+        Otherwise, the standard deviation of the predicted values is stored in the 
+        attribute, `pred_std` (which is not thread-safe).
         
         Parameters
         -----------
         X : array-like or sparse matrix 
             Features of the data.
+        return_std : bool (default=False)
+            If True, also return the standard deviation of the values predicted by the
+            regressors.
+        quantiles : array-like or None (default=None)
+            If not None, also return the quantiles (between 0 and 1) of the values 
+            predicted by the regressors. Quantiles require the predictions of all 
+            regressors for a sample, and are computed for blocks of 1024 samples at a 
+            time. Cannot be combined with time_budget.
+        max_members : int or None (default=None)
+            If not None, only the first max_members regressors are evaluated (see 
+            predict_anytime).
+        time_budget : float or None (default=None)
+            If not None, time in seconds allowed for prediction. Regressors are evaluated
+            in a fixed order until the budget is spent (see predict_anytime). The number
+            of regressors evaluated can be obtained from predict_anytime, or by the 
+            attribute, `n_members_used`, if return_std is False.
         
         Returns
         --------
         y : array-like of shape (n_samples,)
             The predicted target values
+        y_std : ndarray of shape (n_samples,)
+            Standard deviation of the values predicted by the regressors. Only returned 
+            if return_std is True.
+        y_quantiles : ndarray of shape (len(quantiles), n_samples)
+            Quantiles of the values predicted by the regressors. Only returned if 
+            quantiles is not None.
         
         Examples
         ----------
         >>> y_pred = rebagg.predict(X_test)
         >>> pred_std = rebagg.pred_std  # Standard deviation of predictions
+        >>> # Thread-safe
+        >>> y_pred, y_std, y_q = rebagg.predict(X_test, return_std=True, 
+        ...                                     quantiles=[0.05, 0.95])
         """
-        if not self._isfitted:
-            raise ValueError('Rebagg ensemble has not yet been fitted to training data.')
-        y_ensemble = np.array([reg.predict(X) for reg in self.fitted_regs])
+        
+        if quantiles is not None:
+            if time_budget is not None:
+                raise ValueError('quantiles cannot be combined with time_budget')
+            y, y_std, y_quantiles = self._predict_quantiles(X, quantiles, 
+                                                            max_members=max_members)
+            return (y, y_std, y_quantiles) if return_std else (y, y_quantiles)
+        if return_std:
+            y, y_std, n_members = self.predict_anytime(X, max_members=max_members,
+                                                       time_budget=time_budget)
+            return y, y_std
+        
+        if max_members is not None or time_budget is not None:
+            y, self.pred_std, self.n_members_used = self.predict_anytime(X, 
+                                                        max_members=max_members, 
+                                                        time_budget=time_budget)
+            return y
+        y_ensemble = self.predict_all(X)
         y = np.mean(y_ensemble, axis=0)
         self.pred_std = np.std(y_ensemble, axis=0)
+        self.n_members_used = len(y_ensemble)
         assert len(y)==len(X), ('X and y do not have the same number of samples')
         
         return y
+    
+    
+    
+    
+    def predict_iter(self, X, chunk_size=16384):
+        """
+        Predict target values for blocks of samples at a time, so that the memory used 
+        is bounded by the block size rather than the number of samples. Each block is 
+        predicted with predict(X_block, return_std=True), and is read from X only when 
+        it is predicted, so that X may be a memory-mapped array (e.g. np.load(file, 
+        mmap_mode='r')) larger than the memory.
+        
+        Parameters
+        -----------
+        X : array-like or iterable
+            Features of the data. If X is an array (or np.memmap), blocks of chunk_size 
+            rows are predicted. Otherwise, X is an iterable of blocks of rows (e.g. 
+            pd.read_csv(file, chunksize=4096)), and each block is predicted as given.
+        chunk_size : int (default=16384)
+            Number of rows in each block if X is an array.
+        
+        Yields
+        --------
+        (y, y_std) : tuple
+            The predicted target values and the standard deviation of the values 
+            predicted by the regressors for a block of rows.
+        
+        Examples
+        ----------
+        >>> X = np.load('proteome_features.npy', mmap_mode='r')
+        >>> for y_block, std_block in rebagg.predict_iter(X, chunk_size=10000):
+        ...     write(y_block, std_block)
+        """
+        
+        if hasattr(X, 'shape'):
+            blocks = (X[i:i+chunk_size] for i in range(0, X.shape[0], chunk_size))
+        else:
+            blocks = X
+        for X_block in blocks:
+            yield self.predict(np.asarray(X_block), return_std=True)
+    
+    
+    
+    
+    def predict_chunked(self, X, chunk_size=16384, out=None, out_std=None):
+        """
+        Predict target values for blocks of chunk_size samples at a time (see 
+        predict_iter), and write the predictions to arrays.
+        
+        Parameters
+        -----------
+        X : array-like or iterable
+            Features of the data, as an array, np.memmap, or iterable of blocks of rows
+            (see predict_iter).
+        chunk_size : int (default=16384)
+            Number of rows in each block if X is an array.
+        out : ndarray or None (default=None)
+            Array of length n_samples to which the predicted target values are written, 
+            e.g. np.lib.format.open_memmap(file, mode='w+', shape=(n_samples,)), with 
+            shape (n_samples, n_outputs) if each regressor predicts several values per 
+            sample. If None, a new array is returned.
+        out_std : ndarray or None (default=None)
+            Array of length n_samples to which the standard deviation of the values 
+            predicted by the regressors is written. If None, a new array is returned.
+        
+        Returns
+        --------
+        (y, y_std) : tuple
+            The predicted target values (out) and the standard deviations (out_std).
+        """
+        
+        if (out is None or out_std is None) and not hasattr(X, 'shape'):
+            # Number of samples is unknown
+            blocks = list(self.predict_iter(X, chunk_size=chunk_size))
+            if not blocks:
+                blocks = [(np.empty(0), np.empty(0))]
+            y = np.concatenate([y_block for (y_block, std_block) in blocks])
+            y_std = np.concatenate([std_block for (y_block, std_block) in blocks])
+            if out is not None:
+                out[:] = y
+            if out_std is not None:
+                out_std[:] = y_std
+            return (y if out is None else out), (y_std if out_std is None else out_std)
+        
+        start = 0
+        for y_block, std_block in self.predict_iter(X, chunk_size=chunk_size):
+            if out is None:
+                out = np.empty((X.shape[0],) + y_block.shape[1:])
+            if out_std is None:
+                out_std = np.empty((X.shape[0],) + std_block.shape[1:])
+            stop = start + len(y_block)
+            out[start:stop], out_std[start:stop] = y_block, std_block
+            start = stop
+        if out is None or out_std is None:
+            # No samples to predict
+            out = np.empty(0) if out is None else out
+            out_std = np.empty(0) if out_std is None else out_std
+        assert start==len(out), ('out must have the same number of samples as X')
+        
+        return out, out_std
+    
+    
+    
+    
+    def _predict_quantiles(self, X, quantiles, max_members=None, chunk_size=1024):
+        """Return the mean, standard deviation, and quantiles of the values predicted by
+        the first max_members regressors, for blocks of chunk_size samples at a time"""
+        
+        if not self._isfitted:
+            raise ValueError('Rebagg ensemble has not yet been fitted to training data.')
+        if not hasattr(X, 'shape'):
+            X = np.asarray(X)
+        y, y_std, y_quantiles = [], [], []
+        for i in range(0, X.shape[0], chunk_size):
+            y_ensemble = self._predict_members(X[i:i+chunk_size], stop=max_members)
+            y.append(np.mean(y_ensemble, axis=0))
+            y_std.append(np.std(y_ensemble, axis=0))
+            y_quantiles.append(np.quantile(y_ensemble, quantiles, axis=0))
+        
+        return np.concatenate(y), np.concatenate(y_std), \
+               np.concatenate(y_quantiles, axis=1)
+    
+    
+    
+    
+    def ensemble_size_scores(self, X, y, bins, error_threshold, relevance_func, 
+                             relevance_threshold=0.5, k=1e4):
+        """
+        Evaluate the ensembles of the first 1, 2, ..., m regressors on a test set. All 
+        regressors predict X once, and the predictions of the smaller ensembles are 
+        obtained from the cumulative sum of the predictions, so that the performance for
+        every ensemble size is computed without refitting or repeated predictions.
+        
+        Parameters
+        -----------
+        X : array-like or sparse matrix 
+            Features of the test data.
+        y : array-like
+            True target values of the test data.
+        bins : array_like
+            A one-dimensional and monotonically increasing array of boundary values for 
+            splitting y into bins to compute the MCC (see matthews_corrcoef).
+        error_threshold : float
+            Maximum absolute error allowed for a prediction to be considered accurate 
+            (see f1_score).
+        relevance_func : callable
+            Function that maps target values to relevance values for computing the F1 
+            score, e.g. lambda y: sigmoid_relevance(y, cl=None, ch=65). It is applied to
+            y and to the predicted values of each ensemble size.
+        relevance_threshold : float (default=0.5)
+            Threshold of relevance for forming rare and normal domains (see f1_score).
+        k : float (default=1e4)
+            Value that determines the steepness of the accuracy function (see f1_score).
+        
+        Returns
+        --------
+        scores : ndarray of shape (m, 3)
+            R2, MCC, and F1 scores (columns) of the ensemble of the first i+1 regressors
+            (row i). The last row is the performance of the predict method.
+        
+        Examples
+        ----------
+        >>> scores = rebagg.ensemble_size_scores(X_test, y_test, bins=[30, 50, 65, 85],
+        ...                 error_threshold=5, 
+        ...                 relevance_func=lambda y: sigmoid_relevance(y, None, 65))
+        >>> r2, mcc, f1 = scores[49]  # Performance of the first 50 regressors
+        """
+        
+        y = np.squeeze(np.asarray(y))
+        y_ensemble = self.predict_all(X)
+        _check_single_output(y_ensemble, 'ensemble_size_scores')
+        assert y_ensemble.shape[1]==len(y), ('X and y do not have the same number of '
+                                            'samples')
+        m = len(y_ensemble)
+        y_pred = np.cumsum(y_ensemble, axis=0) / np.arange(1, m+1)[:,None]
+        r2 = _r2_rows(y, y_pred)
+        mcc = _mcc_rows(y, y_pred, bins)
+        f1 = _f1_rows(y, y_pred, error_threshold, relevance_func, relevance_threshold, k)
+        
+        return np.column_stack([r2, mcc, f1])
+    
+    
+    
+    
+    def prune(self, X, y, n_members=None, metric='f1', oob=False, bins=None, 
+              error_threshold=None, relevance_func=None, relevance_threshold=0.5, k=1e4):
+        """
+        Select a subset of the regressors in the ensemble by greedy forward selection, 
+        and return a smaller Rebagg ensemble. Starting from an empty ensemble, the 
+        regressor that gives the best score on (X, y) when added to the ensemble is 
+        selected at each step.
+        
+        Parameters
+        -----------
+        X : array-like or sparse matrix 
+            Features of the validation data, or of the training data if oob is True.
+        y : array-like
+            True target values of the validation data, or of the training data if oob is
+            True.
+        n_members : int or None (default=None)
+            Number of regressors selected. If None, the number of regressors with the 
+            best score along the greedy selection is chosen.
+        metric : str, {'f1' | 'mcc' | 'r2' | 'mse'} (default='f1')
+            Score used to select regressors. The F1 score requires error_threshold and 
+            relevance_func (see f1_score), and the MCC requires bins (see 
+            matthews_corrcoef).
+        oob : bool (default=False)
+            If True, X and y are the training data passed to fit, and each sample is 
+            predicted only by the selected regressors for which it is out-of-bag (see 
+            inbag_). Samples that are in-bag for all selected regressors are not scored.
+        bins : array_like or None (default=None)
+            Boundary values for splitting y into bins, if metric is 'mcc'.
+        error_threshold : float or None (default=None)
+            Maximum absolute error allowed for a prediction to be considered accurate, 
+            if metric is 'f1'.
+        relevance_func : callable or None (default=None)
+            Function that maps target values to relevance values, if metric is 'f1' 
+            (see ensemble_size_scores).
+        relevance_threshold : float (default=0.5)
+            Threshold of relevance for forming rare and normal domains, if metric is 
+            'f1'.
+        k : float (default=1e4)
+            Value that determines the steepness of the accuracy function, if metric is
+            'f1'.
+        
+        Returns
+        --------
+        rebagg : Rebagg
+            Ensemble of the selected regressors (in the order of selection). The indices
+            of the selected regressors in fitted_regs are given by the attribute,
+            `selected_members`, and the score after each selection by `prune_scores`.
+        
+        Examples
+        ----------
+        >>> small = rebagg.prune(X_val, y_val, n_members=20, metric='f1', 
+        ...                      error_threshold=5, 
+        ...                      relevance_func=lambda y: sigmoid_relevance(y, None, 65))
+        >>> y_pred = small.predict(X_test)
+        """
+        
+        metric = metric.lower()
+        if metric=='f1':
+            if error_threshold is None or relevance_func is None:
+                raise ValueError("error_threshold and relevance_func must be specified if "
+                                 "metric is 'f1'")
+            score_rows = lambda y_pred: _f1_rows(y, y_pred, error_threshold, 
+                                                 relevance_func, relevance_threshold, k)
+        elif metric=='mcc':
+            if bins is None:
+                raise ValueError("bins must be specified if metric is 'mcc'")
+            score_rows = lambda y_pred: _mcc_rows(y, y_pred, bins)
+        elif metric=='r2':
+            score_rows = lambda y_pred: _r2_rows(y, y_pred)
+        elif metric=='mse':
+            score_rows = lambda y_pred: -_mse_rows(y, y_pred)
+        else:
+            raise ValueError("metric must be 'f1', 'mcc', 'r2', or 'mse'")
+        
+        y = np.squeeze(np.asarray(y))
+        y_ensemble = self.predict_all(X)
+        _check_single_output(y_ensemble, 'prune')
+        assert y_ensemble.shape[1]==len(y), ('X and y do not have the same number of '
+                                            'samples')
+        m = len(y_ensemble)
+        if n_members is None:
+            n_steps = m
+        elif 1 <= n_members <= m:
+            n_steps = n_members
+        else:
+            raise ValueError(f'n_members must be between 1 and m ({m})')
+        weights = (~self.inbag_mask()).astype(float) if oob else np.ones(y_ensemble.shape)
+        y_ensemble = np.where(weights > 0, y_ensemble, 0.0)
+        
+        # Greedy forward selection (without replacement)
+        selected, scores = [], []
+        remaining = np.arange(m)
+        y_sum, n_sum = np.zeros(len(y)), np.zeros(len(y))
+        for step in range(n_steps):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                y_candidates = (y_sum + y_ensemble[remaining]) / \
+                               (n_sum + weights[remaining])  # NaN if not predicted
+            candidate_scores = score_rows(y_candidates)
+            best = np.nanargmax(np.where(np.isnan(candidate_scores), -np.inf, 
+                                         candidate_scores))
+            selected.append(remaining[best])
+            scores.append(candidate_scores[best])
+            y_sum += y_ensemble[remaining[best]]
+            n_sum += weights[remaining[best]]
+            remaining = np.delete(remaining, best)
+        if n_members is None:
+            n_best = int(np.argmax(scores)) + 1
+            selected, scores = selected[:n_best], scores[:n_best]
+        
+        # Smaller ensemble of the selected regressors
+        rebagg = copy.copy(self)
+        for attr in ('oob_prediction_', 'oob_score_', 'pred_std', 'n_members_used'):
+            rebagg.__dict__.pop(attr, None)
+        rebagg.m = len(selected)
+        rebagg.fitted_regs = [self.fitted_regs[i] for i in selected]
+        if getattr(self, 'inbag_', None) is not None:
+            rebagg.inbag_ = self.inbag_[selected]
+        if getattr(self, 'feature_indices', None) is not None:
+            rebagg.feature_indices = self.feature_indices[selected]
+        if getattr(self, 'linear_coef_', None) is not None:
+            rebagg.linear_coef_ = self.linear_coef_[selected]
+            rebagg.linear_intercept_ = self.linear_intercept_[selected]
+        if getattr(self, 'neighbor_counts_', None) is not None:
+            rebagg.neighbor_counts_ = self.neighbor_counts_[selected]
+        rebagg._seed_seq = None  # Cannot be warm started
+        rebagg.packed_trees = None
+        if getattr(self, 'packed_trees', None) is not None:
+            rebagg.pack_trees()
+        rebagg.selected_members = np.array(selected)
+        rebagg.prune_scores = np.array(scores)
+        
+        return rebagg
+    
+    
+    
+    
+    def distill(self, X, y, relevance, relevance_threshold=0.5, student=None, 
+                sample_method='smoter', size=1.0, k=5, delta=0.1, nominal=None, 
+                X_eval=None, relevance_eval=None, random_state=None):
+        """
+        Distill the ensemble into a single fast regressor (student), fitted to the 
+        predictions of the ensemble on the training data and on synthetic samples 
+        generated from the training data with SMOTER or Gaussian noise. Synthetic 
+        samples are generated separately in the rare and normal domains (half from each),
+        so that the student learns the ensemble where the rare domain is sparse. No 
+        synthetic samples are generated from a domain with fewer than 2 samples.
+        
+        Parameters
+        -----------
+        X : array-like
+            Features of the training data.
+        y : array-like
+            The target values of the training data (only used to split the rare and 
+            normal domains for generating synthetic samples with SMOTER).
+        relevance : 1d array-like
+            Values ranging from 0 to 1 that indicate the relevance of target values. 
+        relevance_threshold : float (default=0.5)
+            Threshold of relevance for forming rare and normal domains.
+        student : scikit-learn regressor or None (default=None)
+            Regressor fitted to the predictions of the ensemble, e.g. 
+            GradientBoostingRegressor(n_estimators=50, max_depth=3). If None, a decision
+            tree with max_depth=8.
+        sample_method : str, {'smoter' | 'gaussian' | None} (default='smoter')
+            Method for generating synthetic samples (see smoter_interpolate and 
+            add_gaussian). If None, no synthetic samples are generated.
+        size : int or float (default=1.0)
+            Number of synthetic samples. If float, size * n_samples samples are 
+            generated.
+        k : int (default=5)
+            Number of nearest neighbors for SMOTER.
+        delta : float (default=0.1)
+            Value that determines the magnitude of Gaussian noise.
+        nominal : ndarray (default=None)
+            Column indices of nominal features. If None, then all features are continuous.
+        X_eval : array-like or None (default=None)
+            Features of the data for evaluating the fidelity of the student. If None, the
+            training data is used.
+        relevance_eval : 1d array-like or None (default=None)
+            Relevance of the target values of X_eval, for splitting X_eval into rare and
+            normal domains. Must be specified if X_eval is not None.
+        random_state : int, None, Generator or SeedSequence, optional (default=None)
+            If int, random_state is the seed used by the random number generator. If None, 
+            the random number generator is seeded with fresh entropy. If 
+            np.random.Generator, random numbers are drawn from it, and if 
+            np.random.SeedSequence, from a new Generator. The global state of np.random is
+            not used (see check_random_state).
+        
+        Returns
+        --------
+        (student, fidelity) : tuple
+            The fitted student regressor, and a dataframe of the agreement between the 
+            predictions of the student and the ensemble (R2, RMSE, and MAE) on the rare
+            domain, normal domain, and all samples of X_eval.
+        
+        Examples
+        ----------
+        >>> student, fidelity = rebagg.distill(X_train, y_train, relevance, 
+        ...                                    X_eval=X_test, relevance_eval=rel_test)
+        >>> y_fast = student.predict(X_proteome)
+        """
+        
+        X, y = np.asarray(X), np.squeeze(np.asarray(y))
+        relevance = np.squeeze(np.asarray(relevance))
+        assert len(y)==len(X), ('X and y do not have the same number of samples')
+        assert len(y)==len(relevance), 'y and relevance must be of the same length'
+        if X_eval is not None and relevance_eval is None:
+            raise ValueError('relevance_eval must be specified if X_eval is not None')
+        _check_single_output(self.predict_all(X[:1]), 'distill')
+        seed_seq = seed_sequence(check_random_state(random_state))
+        if student is None:
+            student = DecisionTreeRegressor(max_depth=8)
+        student = copy.deepcopy(student)
+        set_random_state(student, seed_seq)
+        
+        # Synthetic samples from the rare and normal domains
+        X_student = [X]
+        n_synthetic = int(size * len(y)) if type(size)==float else size
+        if sample_method is not None and n_synthetic > 0:
+            n_rare = n_synthetic // 2
+            for is_rare, n_domain in ((True, n_rare), (False, n_synthetic - n_rare)):
+                # Independent stream for each domain
+                domain = np.where((relevance >= relevance_threshold) == is_rare)[0]
+                rng = np.random.default_rng(child_seed_sequence(seed_seq, int(is_rare)))
+                if sample_method not in ('smoter', 'gaussian'):
+                    raise ValueError("sample_method must be 'smoter', 'gaussian', or None")
+                if len(domain) < 2:
+                    # No neighbors to interpolate, or spread to add noise
+                    continue
+                if sample_method=='smoter':
+                    X_new = smoter_interpolate(X[domain,:], y[domain], k=k, 
+                                               size=n_domain, nominal=nominal, 
+                                               vectorize=True, random_state=rng)[0]
+                else:
+                    X_new = add_gaussian(X[domain,:], y[domain], delta=delta, 
+                                         size=n_domain, nominal=nominal, 
+                                         random_state=rng)[0]
+                X_student.append(X_new)
+        X_student = np.concatenate(X_student, axis=0)
+        student.fit(X_student, self.predict_all(X_student).mean(axis=0))
+        
+        # Fidelity of the student to the ensemble
+        if X_eval is None:
+            X_eval, relevance_eval = X, relevance
+        X_eval = np.asarray(X_eval)
+        relevance_eval = np.squeeze(np.asarray(relevance_eval))
+        y_teacher = self.predict_all(X_eval).mean(axis=0)
+        y_student = student.predict(X_eval)
+        rare = relevance_eval >= relevance_threshold
+        fidelity = []
+        for domain in (rare, ~rare, np.ones(len(rare), dtype=bool)):
+            if np.sum(domain) > 1:
+                fidelity.append([np.sum(domain), 
+                    metrics.r2_score(y_teacher[domain], y_student[domain]),
+                    np.sqrt(metrics.mean_squared_error(y_teacher[domain], 
+                                                       y_student[domain])),
+                    metrics.mean_absolute_error(y_teacher[domain], y_student[domain])])
+            else:
+                fidelity.append([np.sum(domain), np.nan, np.nan, np.nan])
+        fidelity = pd.DataFrame(fidelity, index=['rare', 'normal', 'all'], 
+                                columns=['samples', 'r2', 'rmse', 'mae'])
+        
+        return student, fidelity
 
 
 
@@ -0,0 +1,479 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import ElasticNet, LinearRegression, Ridge
+from sklearn.neighbors import KNeighborsRegressor
+from sklearn.svm import SVR
+from sklearn.tree import DecisionTreeRegressor, ExtraTreeRegressor
+
+import resreg
+
+
+
+
+def make_data(n_samples=200, n_features=4, seed=0):
+    rng = np.random.RandomState(seed)
+    X = rng.rand(n_samples, n_features)
+    y = X @ np.arange(1, n_features + 1) + 0.1 * rng.randn(n_samples)
+    relevance = resreg.sigmoid_relevance(y, cl=None, ch=np.percentile(y, 80))
+    return X, y, relevance
+
+
+
+
+def check_multi_output(base_reg, n_outputs):
+    """Run an ensemble of multi-output regressors through the prediction methods, and
+    compare each output with the mean and standard deviation of predict_all"""
+    
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=10, s=0.5, base_reg=base_reg, oob_score=True)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    assert np.shape(rebagg.oob_score_) == (n_outputs,)
+    assert rebagg.oob_prediction_.shape == (len(y), n_outputs)
+    
+    X_test = X[:50]
+    y_ensemble = rebagg.predict_all(X_test)
+    assert y_ensemble.shape == (10, 50, n_outputs)
+    y_mean, y_std = y_ensemble.mean(axis=0), y_ensemble.std(axis=0)
+    
+    np.testing.assert_allclose(rebagg.predict(X_test), y_mean)
+    y_pred, std = rebagg.predict(X_test, return_std=True)
+    np.testing.assert_allclose(y_pred, y_mean)
+    np.testing.assert_allclose(std, y_std, atol=1e-12)
+    y_pred = rebagg.predict(X_test, max_members=3)
+    np.testing.assert_allclose(y_pred, y_ensemble[:3].mean(axis=0))
+    y_pred, std = rebagg.predict(X_test, return_std=True, time_budget=10.0)
+    np.testing.assert_allclose(y_pred, y_mean)
+    
+    y_pred, std, y_q = rebagg.predict(X_test, return_std=True, quantiles=[0.1, 0.9])
+    rebagg_q = rebagg._predict_quantiles(X_test, [0.1, 0.9], chunk_size=16)[2]
+    np.testing.assert_allclose(y_q, np.quantile(y_ensemble, [0.1, 0.9], axis=0))
+    np.testing.assert_allclose(rebagg_q, y_q)
+    
+    blocks = list(rebagg.predict_iter(X_test, chunk_size=20))
+    np.testing.assert_allclose(np.concatenate([b[0] for b in blocks]), y_mean)
+    y_pred, std = rebagg.predict_chunked(X_test, chunk_size=20)
+    np.testing.assert_allclose(y_pred, y_mean)
+    np.testing.assert_allclose(std, y_std, atol=1e-12)
+    
+    variance = rebagg.jackknife_variance(X_test)
+    assert variance.shape == (50, n_outputs)
+    for j in range(n_outputs):
+        # Each output is the jackknife variance of a single-output ensemble
+        single = _SingleOutput(rebagg, j)
+        np.testing.assert_allclose(variance[:,j], 
+                                   resreg.Rebagg.jackknife_variance(single, X_test))
+        np.testing.assert_allclose(rebagg.oob_prediction_[:,j], 
+                                   resreg.Rebagg.oob_predict(single, X))
+    
+    bins = np.percentile(y, [25, 50, 75])
+    with pytest.raises(ValueError, match='single value'):
+        rebagg.ensemble_size_scores(X_test, y[:50], bins, error_threshold=1,
+                                    relevance_func=lambda y: y)
+    with pytest.raises(ValueError, match='single value'):
+        rebagg.prune(X_test, y[:50], metric='r2')
+    with pytest.raises(ValueError, match='single value'):
+        rebagg.distill(X, y, relevance, random_state=0)
+
+
+
+
+class _SklearnRidge(Ridge):
+    """Ridge regressor fitted by scikit-learn rather than fit_linear_members"""
+
+
+
+
+class _SklearnLinearRegression(LinearRegression):
+    """Linear regressor fitted by scikit-learn rather than fit_linear_members"""
+
+
+
+
+class _SingleOutput(resreg.Rebagg):
+    """View of one output of a fitted ensemble of multi-output regressors"""
+    
+    def __init__(self, rebagg, output):
+        self.__dict__.update(rebagg.__dict__)
+        self._rebagg, self._output = rebagg, output
+    
+    def predict_all(self, X):
+        return self._rebagg.predict_all(X)[..., self._output]
+
+
+
+
+@pytest.mark.filterwarnings('ignore:Some samples are in-bag')
+def test_elastic_net_path_members():
+    check_multi_output(resreg.ElasticNetPath(alphas=[1e-3, 1e-1]), 2)
+
+
+
+
+@pytest.mark.filterwarnings('ignore:Some samples are in-bag')
+def test_kneighbors_path_members():
+    check_multi_output(resreg.KNeighborsPath(n_neighbors=[3, 7]), 2)
+
+
+
+
+def test_kneighbors_path_shared_search():
+    # Predictions from the shared neighbor search are those of each regressor
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=5, s=0.5, base_reg=resreg.KNeighborsPath([3, 7]))
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    assert rebagg.neighbor_counts_ is not None
+    y_members = np.array([reg.predict(X[:50]) for reg in rebagg.fitted_regs])
+    np.testing.assert_allclose(rebagg.predict_all(X[:50]), y_members)
+
+
+
+
+def test_quantiles_list_input():
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=5, s=0.5)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    y_pred, y_q = rebagg.predict(X[:10].tolist(), quantiles=[0.5])
+    np.testing.assert_allclose(y_pred, rebagg.predict(X[:10]))
+    np.testing.assert_allclose(y_q[0], np.median(rebagg.predict_all(X[:10]), axis=0))
+
+
+
+
+def test_quantized_trees():
+    # Trees fitted to bins predict from the features as from the bins
+    X, y, relevance = make_data(n_samples=500)
+    X_binned, bin_thresholds = resreg.quantize_features(X, max_bins=32)
+    tree = DecisionTreeRegressor(random_state=0)
+    tree.fit(X_binned.astype(np.float32), y)
+    y_binned = tree.predict(X_binned.astype(np.float32))
+    resreg._unbin_tree(tree, bin_thresholds)
+    np.testing.assert_array_equal(tree.predict(X), y_binned)
+    
+    rebagg = resreg.Rebagg(m=5, s=0.5, quantize_bins=32, max_features=3)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    y_pred = rebagg.predict(X)
+    rebagg.pack_trees()
+    np.testing.assert_allclose(rebagg.predict(X), y_pred)
+
+
+
+
+
+@pytest.mark.parametrize('base_reg, atol', [
+    (ElasticNet(alpha=0.01), 1e-10),
+    (SVR(gamma=0.5, tol=1e-6), 1e-5),
+    (resreg.KNeighborsPath(n_neighbors=[3, 5]), 0)])
+def test_weight_duplicates(base_reg, atol):
+    # Fitting unique rows weighted by their counts is equivalent to fitting duplicated 
+    # rows (see weight_duplicates in Rebagg)
+    X, y, relevance = make_data(n_samples=300)
+    y_pred = []
+    for weight_duplicates in (False, True):
+        rebagg = resreg.Rebagg(m=5, s=200, base_reg=base_reg, 
+                               weight_duplicates=weight_duplicates)
+        rebagg.fit(X, y, relevance, 0.5, random_state=0)
+        y_pred.append(rebagg.predict_all(X))
+    np.testing.assert_allclose(y_pred[1], y_pred[0], rtol=0, atol=atol)
+
+
+
+
+@pytest.mark.parametrize('base_reg', [DecisionTreeRegressor(), ExtraTreeRegressor()])
+def test_weight_duplicates_trees(base_reg):
+    # Trees predict their drawn rows identically, but may break ties between splits 
+    # on different features differently, and so predict other rows differently
+    X, y, relevance = make_data(n_samples=300)
+    y_pred = []
+    for weight_duplicates in (False, True):
+        rebagg = resreg.Rebagg(m=5, s=200, base_reg=base_reg, 
+                               weight_duplicates=weight_duplicates)
+        rebagg.fit(X, y, relevance, 0.5, random_state=0)
+        y_pred.append(rebagg.predict_all(X))
+    inbag = rebagg.inbag_mask()
+    np.testing.assert_allclose(y_pred[1][inbag], y_pred[0][inbag], rtol=0, atol=1e-12)
+
+
+
+
+def test_weight_duplicates_counts_rows():
+    # Not equivalent if a parameter counts rows rather than weights
+    X, y, relevance = make_data(n_samples=300)
+    y_pred = []
+    for weight_duplicates in (False, True):
+        rebagg = resreg.Rebagg(m=5, s=200, weight_duplicates=weight_duplicates,
+                               base_reg=DecisionTreeRegressor(min_samples_leaf=5))
+        rebagg.fit(X, y, relevance, 0.5, random_state=0)
+        y_pred.append(rebagg.predict_all(X))
+    assert not np.allclose(y_pred[1], y_pred[0])
+
+
+
+
+def test_relevance_function_cache():
+    X, y, relevance = make_data()
+    relevance_func = resreg.RelevanceFunction(max_entries=2)
+    params = [(None, 8.0), (2.0, 8.0), (2.0, None)]
+    values = relevance_func.evaluate(y, params)
+    for (cl, ch), row in zip(params, values):
+        np.testing.assert_array_equal(row, resreg.sigmoid_relevance(y, cl, ch))
+    
+    # Stored rows do not keep the returned array alive, and returned arrays are copies
+    assert len(relevance_func._relevance) == 2
+    for row in relevance_func._relevance.values():
+        assert row.base is None
+        assert not np.shares_memory(row, values)
+    values[:] = 0
+    cached = relevance_func(y, 2.0, None)
+    np.testing.assert_array_equal(cached, resreg.sigmoid_relevance(y, 2.0, None))
+    assert relevance_func.hits == 1
+    cached[:] = 0
+    np.testing.assert_array_equal(relevance_func(y, 2.0, None), 
+                                  resreg.sigmoid_relevance(y, 2.0, None))
+
+
+
+
+def test_int_seeds_thread_safe():
+    # Integer seeds do not use the global state of np.random, so that calls in separate
+    # threads reproduce the results of sequential calls
+    from concurrent.futures import ThreadPoolExecutor
+    X, y, relevance = make_data()
+    resample = lambda seed: resreg.wercs(X, y, relevance, noise=True, random_state=seed)
+    expected = [resample(seed) for seed in range(8)]
+    np.random.seed(0)
+    state = np.random.get_state()[1].copy()
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(resample, range(8)))
+    for (X_new, y_new), (X_exp, y_exp) in zip(results, expected):
+        np.testing.assert_array_equal(X_new, X_exp)
+        np.testing.assert_array_equal(y_new, y_exp)
+    np.testing.assert_array_equal(np.random.get_state()[1], state)
+
+
+
+
+def test_nested_seed_sequence_streams():
+    # Nested calls draw from independent children of a SeedSequence
+    X, y, relevance = make_data()
+    seed_seq = np.random.SeedSequence(0)
+    X_new, y_new = resreg.smoter(X, y, relevance, over='balance', random_state=seed_seq)
+    X_again = resreg.smoter(X, y, relevance, over='balance', 
+                            random_state=np.random.SeedSequence(0))[0]
+    np.testing.assert_array_equal(X_new, X_again)
+    rng = resreg.check_random_state(seed_seq)
+    children = [resreg._nested_random_state(seed_seq, rng, i) for i in range(3)]
+    states = [child.generate_state(4) for child in children]
+    assert len({tuple(state) for state in states}) == 3
+    assert not any(np.array_equal(state, seed_seq.generate_state(4)) for state in states)
+
+
+
+
+@pytest.mark.parametrize('base_reg', ['packed', Ridge(alpha=1.0), 
+                                      KNeighborsRegressor(n_neighbors=5)])
+def test_predict_anytime_batch_predictor(base_reg):
+    # Anytime predictions use the batch predictor of the ensemble, not each regressor
+    X, y, relevance = make_data()
+    packed = base_reg == 'packed'
+    base_reg = DecisionTreeRegressor(random_state=0) if packed else base_reg
+    rebagg = resreg.Rebagg(m=20, s=0.5, base_reg=base_reg)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    if packed:
+        rebagg.pack_trees()
+    X_test = X[:50]
+    y_ensemble = rebagg.predict_all(X_test)
+    for reg in rebagg.fitted_regs:
+        reg.predict = None
+    
+    for max_members, chunk_size in [(None, 1024), (7, 1024), (None, 16)]:
+        y_pred, y_std, n = rebagg.predict_anytime(X_test, max_members=max_members, 
+                                                  chunk_size=chunk_size)
+        assert n == (max_members or 20)
+        np.testing.assert_allclose(y_pred, y_ensemble[:n].mean(axis=0))
+        np.testing.assert_allclose(y_std, y_ensemble[:n].std(axis=0), atol=1e-12)
+    for max_memory in [256, 1e-3]:
+        y_pred, y_std, n = rebagg.predict_anytime(X_test, time_budget=10.0, 
+                                                  max_memory=max_memory)
+        assert n == 20
+        np.testing.assert_allclose(y_pred, y_ensemble.mean(axis=0))
+        np.testing.assert_allclose(y_std, y_ensemble.std(axis=0), atol=1e-12)
+    assert rebagg.predict_anytime(X_test, time_budget=0.0)[2] == 1
+
+
+
+
+def test_predict_std_blocks():
+    # Without a time budget, only the predictions for a block of samples are held
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=10, s=0.5)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    shapes = []
+    predict_members = rebagg._predict_members
+    def record(X, start=0, stop=None):
+        y_members = predict_members(X, start, stop)
+        shapes.append(y_members.shape)
+        return y_members
+    rebagg._predict_members = record
+    rebagg.predict_anytime(X, chunk_size=64)
+    assert shapes == [(10, 64)] * 3 + [(10, 8)]
+
+
+
+
+def test_predict_anytime_memory_outputs():
+    # Batches are sized with all outputs of multi-output regressors
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=10, s=0.5, base_reg=resreg.ElasticNetPath([.01, .1, 1]))
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    shapes = []
+    predict_members = rebagg._predict_members
+    def record(X, start=0, stop=None):
+        y_members = predict_members(X, start, stop)
+        shapes.append(y_members.shape)
+        return y_members
+    rebagg._predict_members = record
+    max_memory = 2 * 50 * 3 * 8 / 2**20  # Predictions of 2 regressors
+    y_pred, y_std, n = rebagg.predict_anytime(X[:50], time_budget=10.0, 
+                                              max_memory=max_memory)
+    assert n == 10 and max(shape[0] for shape in shapes) == 2
+    assert all(shape[1:] == (50, 3) for shape in shapes)
+    np.testing.assert_allclose(y_pred, rebagg.predict_all(X[:50]).mean(axis=0))
+
+
+
+
+def test_predict_chunked_empty():
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=5, s=0.5)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    for X_empty in [X[:0], iter([])]:
+        y_pred, y_std = rebagg.predict_chunked(X_empty, chunk_size=16)
+        assert y_pred.shape == (0,) and y_std.shape == (0,)
+    out, out_std = np.empty(0), np.empty(0)
+    y_pred, y_std = rebagg.predict_chunked(X[:0], out=out, out_std=out_std)
+    assert y_pred is out and y_std is out_std
+
+
+
+
+def test_get_neighbors_algorithms():
+    # Neighbors match the exact search over the full distance matrix, and their 
+    # distances match if cases are tied (duplicate rows)
+    from scipy.spatial.distance import pdist, squareform
+    X = make_data(n_samples=150)[0]
+    X_ties = np.concatenate([X, X[:30], np.round(X[30:60], 1)])
+    for X_test, exact in [(X, True), (X_ties, False)]:
+        dist = squareform(pdist(X_test))
+        reference = np.argsort(dist, axis=1)[:, 1:8]
+        for algorithm in ['brute', 'kd_tree', 'ball_tree']:
+            for max_memory in [256, 1e-3]:
+                neighbors = resreg.get_neighbors(X_test, 7, algorithm=algorithm, 
+                                                 max_memory=max_memory)
+                assert neighbors.shape == reference.shape
+                if exact:
+                    np.testing.assert_array_equal(neighbors, reference)
+                np.testing.assert_allclose(np.take_along_axis(dist, neighbors, axis=1),
+                                           np.take_along_axis(dist, reference, axis=1))
+
+
+
+
+@pytest.mark.parametrize('sample_method', ['smoter', 'gaussian'])
+def test_distill_single_rare_sample(sample_method):
+    # No synthetic samples are generated from a domain with a single sample
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=5, s=0.5)
+    rebagg.fit(X, y, relevance, 0.5, random_state=0)
+    relevance = (y >= np.max(y)).astype(float)
+    assert np.sum(relevance >= 0.5) == 1
+    student, fidelity = rebagg.distill(X, y, relevance, 0.5, 
+                                       sample_method=sample_method, random_state=0)
+    assert fidelity.loc['rare', 'samples'] == 1
+    assert fidelity.loc['all', 'samples'] == len(y)
+
+
+
+
+@pytest.mark.parametrize('sample_method', ['random_oversample', 'smoter'])
+def test_parallel_fit_same_ensemble(sample_method):
+    # Ensembles fitted in threads or processes are those fitted sequentially
+    X, y, relevance = make_data()
+    ensembles = []
+    for n_jobs, backend in [(None, None), (2, 'threads'), (2, 'processes')]:
+        rebagg = resreg.Rebagg(m=6, s=0.5, base_reg=DecisionTreeRegressor(), 
+                               n_jobs=n_jobs, backend=backend)
+        rebagg.fit(X, y, relevance, 0.5, sample_method=sample_method, random_state=0)
+        ensembles.append(rebagg)
+    for rebagg in ensembles[1:]:
+        np.testing.assert_array_equal(rebagg.inbag_, ensembles[0].inbag_)
+        np.testing.assert_array_equal(rebagg.predict_all(X), ensembles[0].predict_all(X))
+    # The trees and the rows draw from separate children of the stream of a regressor
+    member_seq = resreg.child_seed_sequence(resreg.seed_sequence(0), 0)
+    tree_seq = resreg.child_seed_sequence(member_seq, 2)
+    random_state = ensembles[0].fitted_regs[0].random_state
+    assert random_state == int(tree_seq.generate_state(1)[0])
+    assert random_state != int(member_seq.generate_state(1)[0])
+
+
+
+
+@pytest.mark.parametrize('sample_method', ['random_oversample', 'smoter'])
+def test_warm_start_same_ensemble(sample_method):
+    # Growing an ensemble from m=5 to m=10 gives the ensemble fitted with m=10
+    X, y, relevance = make_data()
+    rebagg = resreg.Rebagg(m=5, s=0.5, base_reg=DecisionTreeRegressor(), 
+                           warm_start=True, max_features=3)
+    rebagg.fit(X, y, relevance, 0.5, sample_method=sample_method, random_state=0)
+    first_regs = list(rebagg.fitted_regs)
+    rebagg.m = 10
+    rebagg.fit(X, y, relevance, 0.5, sample_method=sample_method, random_state=0)
+    assert all(a is b for a, b in zip(rebagg.fitted_regs[:5], first_regs))
+    fresh = resreg.Rebagg(m=10, s=0.5, base_reg=DecisionTreeRegressor(), 
+                          max_features=3)
+    fresh.fit(X, y, relevance, 0.5, sample_method=sample_method, random_state=0)
+    np.testing.assert_array_equal(rebagg.inbag_, fresh.inbag_)
+    np.testing.assert_array_equal(rebagg.feature_indices, fresh.feature_indices)
+    np.testing.assert_array_equal(rebagg.predict_all(X), fresh.predict_all(X))
+
+
+
+
+
+@pytest.mark.parametrize('base_reg, sklearn_reg', 
+                         [(Ridge(alpha=0.5), _SklearnRidge(alpha=0.5)), 
+                          (LinearRegression(), _SklearnLinearRegression())])
+@pytest.mark.parametrize('max_features', [None, 2])
+def test_fit_linear_members(base_reg, sklearn_reg, max_features):
+    # The stacked fit of linear regressors is that of scikit-learn for each regressor
+    X, y, relevance = make_data()
+    ensembles = []
+    for reg in [base_reg, sklearn_reg]:
+        rebagg = resreg.Rebagg(m=8, s=0.5, base_reg=reg, max_features=max_features)
+        rebagg.fit(X, y, relevance, 0.5, random_state=0)
+        ensembles.append(rebagg)
+    stacked, fitted = ensembles
+    assert stacked.linear_coef_ is not None and fitted.linear_coef_ is None
+    np.testing.assert_array_equal(stacked.inbag_, fitted.inbag_)
+    np.testing.assert_allclose(stacked.predict_all(X), fitted.predict_all(X), 
+                               rtol=1e-10, atol=1e-10)
+
+
+
+
+@pytest.mark.parametrize('bandwidth, grid_size', [(1.0, 2048), (1.0, 512), (0.5, 1024), 
+                                                  (3.0, 64)])
+def test_pdf_relevance_binned_bound(bandwidth, grid_size):
+    # Binned relevance values are within the documented error bound of the exact ones
+    from sklearn.neighbors import KernelDensity
+    rng = np.random.RandomState(0)
+    y = np.concatenate([rng.normal(50, 8, 2000), rng.normal(80, 3, 100)])
+    exact = resreg.pdf_relevance(y, bandwidth=bandwidth)
+    binned = resreg.pdf_relevance(y, bandwidth=bandwidth, method='binned', 
+                                  grid_size=grid_size)
+    pdf = np.exp(KernelDensity(bandwidth=bandwidth).fit(y[:,None]).score_samples(
+                                                                        y[:,None]))
+    spacing = (y.max() - y.min()) / (grid_size - 1)
+    error = spacing**2 / (4 * np.sqrt(2 * np.pi) * bandwidth**3)
+    bound = 4 * error / (np.ptp(pdf) - 2 * error)
+    assert bound < 1
+    assert np.max(np.abs(binned - exact)) <= bound